@@ -1,11 +1,24 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Header, Query, Request
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Literal, Optional, Union
 from compare_models import ModelComparison
+from circuit_breaker import CircuitBreakerRegistry
+from collection_manager import CollectionManager, CollectionNotFound, DEFAULT_COLLECTION
+from ollama_pool import OllamaPool
+from rag_system import RAGSystem
+from response_format import SelectiveGZipMiddleware, compact_results, render, select_fields, wants_msgpack
 import uvicorn
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
-from fastapi.responses import Response
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from profiling import ProfileMiddleware, ProfilerManager
+from query_history import QueryHistoryStore
+import asyncio
+import os
+import secrets
+import threading
 import time
+import uuid
+import orjson
 import mlflow
 from datetime import datetime
 
@@ -14,8 +27,30 @@ app = FastAPI(
     description="REST API for querying documents with multiple LLMs",
     version="1.0.0"
 )
+# Negotiated via Accept-Encoding; small responses and the NDJSON stream are sent as-is
+app.add_middleware(SelectiveGZipMiddleware, exclude_paths=["/query/stream"], minimum_size=1000)
 
-comparison = None
+# Debug/profiling surface: only exists when ADMIN_TOKEN is set, so it costs nothing otherwise
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+profiler = ProfilerManager(output_dir=os.getenv("PROFILE_DIR", "profiles"))
+if ADMIN_TOKEN:
+    app.add_middleware(ProfileMiddleware, manager=profiler)
+
+models = [
+    "qwen2.5:7b",
+    "codellama:7b-instruct",
+    "deepseek-r1:7b",
+    "phi3:mini"
+]
+pool = None
+breakers = None
+collection_store = None
+history = None
+# Real state of the default index: starting -> loading -> ready | failed
+index_state = {"state": "starting", "error": None, "since": time.time()}
+startup_task = None
+reload_jobs = {}
+reload_lock = threading.Lock()
 
 # Setup MLflow
 mlflow.set_tracking_uri("file:./mlruns")
@@ -24,13 +59,61 @@ mlflow.set_experiment("rag-api-queries")
 # Prometheus metrics
 query_counter = Counter('rag_queries_total', 'Total number of queries', ['model'])
 query_duration = Histogram('rag_query_duration_seconds', 'Query duration', ['model'])
+cache_hit_ratio = Gauge('rag_cache_hit_ratio', 'Cache hit ratio', ['collection', 'cache'])
+cache_bytes = Gauge('rag_cache_bytes', 'Approximate cache memory use in bytes', ['collection', 'cache'])
+cache_entries = Gauge('rag_cache_entries', 'Number of cached entries', ['collection', 'cache'])
+collection_memory = Gauge('rag_collection_memory_bytes', 'Estimated resident memory per loaded collection', ['collection'])
+
+class MetadataFilter(BaseModel):
+    # Restrict retrieval to chunks from matching source files
+    source_prefix: Optional[str] = None
+    sources: Optional[List[str]] = None
+    ingested_after: Optional[datetime] = None
+    ingested_before: Optional[datetime] = None
+
+    def to_filters(self):
+        return {
+            "source_prefix": self.source_prefix,
+            "sources": self.sources,
+            "ingested_after": self.ingested_after.timestamp() if self.ingested_after else None,
+            "ingested_before": self.ingested_before.timestamp() if self.ingested_before else None
+        }
 
 class QueryRequest(BaseModel):
     question: str
     models: Optional[List[str]] = None
     k: Optional[int] = 3
+    collection: Optional[str] = DEFAULT_COLLECTION
     parallel: Optional[bool] = True
     track_mlflow: Optional[bool] = True
+    # "full" repeats sources per model (original schema); "compact" shares one sources list
+    format: Optional[Literal["full", "compact"]] = "full"
+    # Per-model result fields to return, e.g. ["time", "metrics"]; None returns everything
+    fields: Optional[List[str]] = None
+    filters: Optional[MetadataFilter] = None
+
+class ProfileWindowRequest(BaseModel):
+    seconds: float = 30.0
+    wait: bool = False
+
+class ProfileMatchRequest(BaseModel):
+    header: str = "X-Profile"
+    value: str = "1"
+    max_requests: int = 10
+
+class TracemallocRequest(BaseModel):
+    frames: int = 25
+
+class ReloadRequest(BaseModel):
+    collection: str = DEFAULT_COLLECTION
+    # Rebuild from these documents; without it the collection's saved index is reloaded
+    docs_path: Optional[str] = None
+
+def require_admin(x_admin_token: Optional[str] = Header(default=None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
 
 class QueryResponse(BaseModel):
     question: str
@@ -38,20 +121,55 @@ class QueryResponse(BaseModel):
     total_time: float
     mlflow_run_id: Optional[str] = None
 
+class CompactQueryResponse(BaseModel):
+    question: str
+    sources: List[str]
+    results: dict
+    total_time: float
+    mlflow_run_id: Optional[str] = None
+
 @app.on_event("startup")
 async def startup_event():
-    global comparison
-    models = [
-        "qwen2.5:7b",
-        "codellama:7b-instruct",
-        "deepseek-r1:7b",
-        "phi3:mini"
-    ]
-    comparison = ModelComparison(models)
-    comparison.setup(vectorstore_path="vectorstore")
-    print("RAG system loaded and ready")
+    global pool, breakers, collection_store, history, startup_task
+    history = QueryHistoryStore(os.getenv("QUERY_HISTORY_DB", "query_history.db"))
+    pool = OllamaPool.from_env()
+    pool.start()
+    breakers = CircuitBreakerRegistry()
+    # Every collection shares the Ollama pool; each has its own index and caches
+    collection_store = CollectionManager(
+        lambda: RAGSystem(pool=pool),
+        base_dir=os.getenv("COLLECTIONS_DIR", "collections"),
+        default_path="vectorstore",
+        memory_budget_bytes=int(float(os.getenv("COLLECTION_MEMORY_BUDGET_MB", "4096")) * 1024 * 1024)
+    )
+    collection_store.pin(DEFAULT_COLLECTION)
+    # Load the index in the background so the server answers liveness probes right away
+    startup_task = asyncio.create_task(asyncio.to_thread(load_default_index))
     print(f"MLflow tracking URI: {mlflow.get_tracking_uri()}")
 
+def set_index_state(state, error=None):
+    index_state.update(state=state, error=error, since=time.time())
+
+def load_default_index():
+    set_index_state("loading")
+    try:
+        with collection_store.lease(DEFAULT_COLLECTION):
+            pass
+    except Exception as e:
+        set_index_state("failed", str(e))
+        print(f"Failed to load vector store: {e}")
+        return
+    set_index_state("ready")
+    print("RAG system loaded and ready")
+
+def is_ready():
+    return index_state["state"] == "ready" and any(backend.healthy for backend in pool.backends)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if history:
+        history.close()
+
 @app.get("/")
 async def root():
     return {
@@ -60,53 +178,127 @@ async def root():
         "features": ["FastAPI", "MLflow Tracking", "Prometheus Metrics", "Parallel Execution"],
         "endpoints": {
             "/query": "POST - Query documents with multiple LLMs",
+            "/query/stream": "POST - Stream answers from multiple LLMs as NDJSON events",
             "/models": "GET - List available models",
+            "/collections": "GET - List document collections and their memory use",
             "/health": "GET - Health check",
-            "/metrics": "GET - Prometheus metrics"
+            "/health/live": "GET - Liveness probe",
+            "/health/ready": "GET - Readiness probe (503 until the index is loaded)",
+            "/metrics": "GET - Prometheus metrics",
+            "/stats": "GET - Per-model latency percentiles and throughput from query history"
         }
     }
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "vectorstore": "loaded", "mlflow": "active"}
+    return {
+        "status": "healthy" if is_ready() else "not_ready",
+        "vectorstore": index_state["state"],
+        "vectorstore_error": index_state["error"],
+        "collections": collection_store.status(),
+        "mlflow": "active",
+        "ollama_backends": pool.status(),
+        "circuit_breakers": breakers.status()
+    }
+
+@app.get("/health/live")
+async def liveness():
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness():
+    body = {
+        "ready": is_ready(),
+        "vectorstore": index_state["state"],
+        "error": index_state["error"],
+        "healthy_backends": sum(1 for backend in pool.backends if backend.healthy)
+    }
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
 
 @app.get("/models")
 async def list_models():
-    return {"models": comparison.models}
+    states = breakers.status()
+    return {
+        "models": models,
+        "circuit_breakers": {model: states.get(model, {"state": "closed"}) for model in models}
+    }
+
+@app.get("/collections")
+async def list_collections():
+    return collection_store.status()
 
 @app.get("/metrics")
 async def metrics():
+    # Collections come and go, so drop series for evicted ones before re-populating
+    for gauge in (cache_hit_ratio, cache_bytes, cache_entries, collection_memory):
+        gauge.clear()
+    for collection, rag in collection_store.loaded().items():
+        stats = rag.cache_stats()
+        for name in ("embedding", "retrieval"):
+            cache_hit_ratio.labels(collection=collection, cache=name).set(stats[name]["hit_ratio"])
+            cache_bytes.labels(collection=collection, cache=name).set(stats[name]["bytes"])
+            cache_entries.labels(collection=collection, cache=name).set(stats[name]["entries"])
+    for collection, info in collection_store.status()["loaded"].items():
+        collection_memory.labels(collection=collection).set(info["memory_bytes"])
     return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
-@app.post("/query", response_model=QueryResponse)
-async def query_documents(request: QueryRequest):
+@app.get("/stats")
+async def query_stats(
+    window: float = Query(3600.0, gt=0, description="Seconds before `until` to aggregate over"),
+    since: Optional[float] = Query(None, description="Window start (unix seconds); overrides `window`"),
+    until: Optional[float] = Query(None, description="Window end (unix seconds); defaults to now"),
+    models: Optional[List[str]] = Query(None),
+    collection: Optional[str] = Query(None)
+):
+    until = until if until is not None else time.time()
+    since = since if since is not None else until - window
+    if since >= until:
+        raise HTTPException(status_code=400, detail="since must be before until")
+    stats = await asyncio.to_thread(history.stats, since, until, models, collection)
+    return {"since": since, "until": until, "models": stats}
+
+async def acquire_collection(name):
+    if name == DEFAULT_COLLECTION and index_state["state"] != "ready":
+        raise HTTPException(
+            status_code=503,
+            detail=f"Vector store is {index_state['state']}",
+            headers={"Retry-After": "5"}
+        )
+    try:
+        return await asyncio.to_thread(collection_store.acquire, name)
+    except CollectionNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+# Responses are serialized by Pydantic from the declared models; msgpack bodies bypass them
+@app.post(
+    "/query",
+    response_model=Union[QueryResponse, CompactQueryResponse],
+    responses={200: {"content": {"application/msgpack": {}}}}
+)
+async def query_documents(request: QueryRequest, accept: Optional[str] = Header(default=None)):
     if not request.question:
         raise HTTPException(status_code=400, detail="Question cannot be empty")
     
-    models_to_use = request.models if request.models else comparison.models
+    models_to_use = request.models if request.models else models
+    collection = request.collection or DEFAULT_COLLECTION
+    filters = request.filters.to_filters() if request.filters else None
+    rag = await acquire_collection(collection)
     
     start = time.time()
     run_id = None
     
-    # Start MLflow run if tracking enabled
-    if request.track_mlflow:
-        mlflow_run = mlflow.start_run(run_name=f"api_query_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
-        run_id = mlflow_run.info.run_id
-        
-        mlflow.log_param("question", request.question)
-        mlflow.log_param("num_sources", request.k)
-        mlflow.log_param("num_models", len(models_to_use))
-        mlflow.log_param("parallel_execution", request.parallel)
-        mlflow.log_param("source", "api")
-    
-    temp_comparison = ModelComparison(models_to_use)
-    temp_comparison.rag = comparison.rag
-    
-    results = temp_comparison.compare(
-        question=request.question,
-        k=request.k,
-        parallel=request.parallel
-    )
+    try:
+        # Share the loaded index, Ollama pool and breakers instead of building new ones per request
+        temp_comparison = ModelComparison(models_to_use, rag=rag, breakers=breakers)
+        results = await asyncio.to_thread(
+            temp_comparison.compare,
+            question=request.question,
+            k=request.k,
+            parallel=request.parallel,
+            filters=filters
+        )
+    finally:
+        collection_store.release(collection, rag)
     
     total_time = time.time() - start
     
@@ -114,24 +306,229 @@ async def query_documents(request: QueryRequest):
     for model, result in results.items():
         query_counter.labels(model=model).inc()
         query_duration.labels(model=model).observe(result["time"])
+    history.record(results, request.k, source="api", collection=collection)
     
-    # Log to MLflow
+    # Log to MLflow. The whole run is opened and closed here, with no await in between,
+    # so concurrent requests never share the fluent API's active run.
     if request.track_mlflow:
-        mlflow.log_metric("total_execution_time", total_time)
+        with mlflow.start_run(run_name=f"api_query_{datetime.now().strftime('%Y%m%d_%H%M%S')}") as mlflow_run:
+            run_id = mlflow_run.info.run_id
+            
+            mlflow.log_param("question", request.question)
+            mlflow.log_param("num_sources", request.k)
+            mlflow.log_param("num_models", len(models_to_use))
+            mlflow.log_param("parallel_execution", request.parallel)
+            mlflow.log_param("collection", collection)
+            mlflow.log_param("source", "api")
+            if filters:
+                mlflow.log_param("filters", request.filters.model_dump_json(exclude_none=True))
+            mlflow.log_metric("total_execution_time", total_time)
+            
+            for model, result in results.items():
+                model_safe = model.replace(":", "_").replace(".", "_")
+                mlflow.log_metric(f"{model_safe}_response_time", result["time"])
+                mlflow.log_metric(f"{model_safe}_tokens_per_sec", result["metrics"]["tokens_per_second"])
+    
+    results = select_fields(results, request.fields)
+    
+    if request.format == "compact":
+        sources, results = compact_results(results)
+        response = CompactQueryResponse(
+            question=request.question,
+            sources=sources,
+            results=results,
+            total_time=round(total_time, 2),
+            mlflow_run_id=run_id
+        )
+    else:
+        response = QueryResponse(
+            question=request.question,
+            results=results,
+            total_time=round(total_time, 2),
+            mlflow_run_id=run_id
+        )
+    if wants_msgpack(accept):
+        return render(response.model_dump(), accept)
+    return response
+
+class LeasedStreamingResponse(StreamingResponse):
+    """Releases a collection lease when the response ends, including when the
+    client disconnects before the body iterator has started."""
+    
+    def __init__(self, content, release, **kwargs):
+        super().__init__(content, **kwargs)
+        self.release = release
+    
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            try:
+                await self.body_iterator.aclose()
+            finally:
+                self.release()
+
+@app.post("/query/stream")
+async def query_documents_stream(request: QueryRequest, http_request: Request):
+    if not request.question:
+        raise HTTPException(status_code=400, detail="Question cannot be empty")
+    
+    models_to_use = request.models if request.models else models
+    collection = request.collection or DEFAULT_COLLECTION
+    filters = request.filters.to_filters() if request.filters else None
+    rag = await acquire_collection(collection)
+    temp_comparison = ModelComparison(models_to_use, rag=rag, breakers=breakers)
+    
+    cancel = threading.Event()
+    stream = temp_comparison.stream_compare(request.question, k=request.k, filters=filters, cancel=cancel)
+    
+    async def events():
+        start = time.time()
+        results = {}
+        try:
+            while True:
+                # Poll for a disconnect while waiting, since a model can take a while to load
+                step = asyncio.ensure_future(asyncio.to_thread(next, stream, None))
+                while not step.done():
+                    await asyncio.wait({step}, timeout=0.5)
+                    if not step.done() and await http_request.is_disconnected():
+                        return
+                event = step.result()
+                if event is None:
+                    break
+                if event["event"] == "done":
+                    result = event["result"]
+                    results[event["model"]] = result
+                    query_counter.labels(model=event["model"]).inc()
+                    query_duration.labels(model=event["model"]).observe(result["time"])
+                yield orjson.dumps(event) + b"\n"
+        finally:
+            # Stops every model still generating; stream_compare does not wait for them
+            cancel.set()
+            try:
+                stream.close()
+            except ValueError:
+                # Still inside next() on a worker thread, which returns once it sees cancel
+                pass
+        total_time = time.time() - start
+        history.record(results, request.k, source="api_stream", collection=collection)
         
-        for model, result in results.items():
-            model_safe = model.replace(":", "_").replace(".", "_")
-            mlflow.log_metric(f"{model_safe}_response_time", result["time"])
-            mlflow.log_metric(f"{model_safe}_tokens_per_sec", result["metrics"]["tokens_per_second"])
+        run_id = None
+        if request.track_mlflow:
+            with mlflow.start_run(run_name=f"api_stream_{datetime.now().strftime('%Y%m%d_%H%M%S')}") as run:
+                run_id = run.info.run_id
+                mlflow.log_param("question", request.question)
+                mlflow.log_param("num_sources", request.k)
+                mlflow.log_param("num_models", len(models_to_use))
+                mlflow.log_param("collection", collection)
+                mlflow.log_param("source", "api_stream")
+                if filters:
+                    mlflow.log_param("filters", request.filters.model_dump_json(exclude_none=True))
+                mlflow.log_metric("total_execution_time", total_time)
+                for model, result in results.items():
+                    model_safe = model.replace(":", "_").replace(".", "_")
+                    mlflow.log_metric(f"{model_safe}_response_time", result["time"])
+                    mlflow.log_metric(f"{model_safe}_tokens_per_sec", result["metrics"]["tokens_per_second"])
+                    if result["metrics"].get("ttft") is not None:
+                        mlflow.log_metric(f"{model_safe}_ttft", result["metrics"]["ttft"])
         
-        mlflow.end_run()
+        yield orjson.dumps({"event": "end", "total_time": round(total_time, 2), "mlflow_run_id": run_id}) + b"\n"
     
-    return QueryResponse(
-        question=request.question,
-        results=results,
-        total_time=round(total_time, 2),
-        mlflow_run_id=run_id
+    return LeasedStreamingResponse(
+        events(), release=lambda: collection_store.release(collection, rag), media_type="application/x-ndjson"
     )
 
+@app.get("/debug/profile", dependencies=[Depends(require_admin)])
+async def profile_status():
+    return {**profiler.status(), "files": profiler.files()}
+
+@app.post("/debug/profile/window", dependencies=[Depends(require_admin)])
+async def profile_window(request: ProfileWindowRequest):
+    try:
+        result = profiler.start_window(request.seconds)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not request.wait:
+        return {"status": "started", "seconds": request.seconds, "output_dir": profiler.output_dir}
+    # Resolved by the window's timer, or earlier if the window is stopped by hand
+    path = await asyncio.wrap_future(result)
+    with open(path, encoding="utf-8") as f:
+        return PlainTextResponse(f.read(), headers={"X-Profile-File": path})
+
+@app.post("/debug/profile/match", dependencies=[Depends(require_admin)])
+async def profile_match(request: ProfileMatchRequest):
+    profiler.set_match(request.header, request.value, request.max_requests)
+    return profiler.status()
+
+@app.delete("/debug/profile/match", dependencies=[Depends(require_admin)])
+async def profile_match_clear():
+    profiler.clear_match()
+    return profiler.status()
+
+@app.get("/debug/profile/files/{name}", dependencies=[Depends(require_admin)])
+async def profile_file(name: str):
+    path = os.path.join(profiler.output_dir, os.path.basename(name))
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    with open(path, encoding="utf-8") as f:
+        return PlainTextResponse(f.read())
+
+@app.post("/debug/tracemalloc/start", dependencies=[Depends(require_admin)])
+async def tracemalloc_start(request: TracemallocRequest):
+    profiler.start_tracemalloc(request.frames)
+    return profiler.status()
+
+@app.post("/debug/tracemalloc/snapshot", dependencies=[Depends(require_admin)])
+async def tracemalloc_snapshot():
+    try:
+        return profiler.tracemalloc_snapshot()
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.post("/debug/tracemalloc/stop", dependencies=[Depends(require_admin)])
+async def tracemalloc_stop():
+    profiler.stop_tracemalloc()
+    return profiler.status()
+
+def run_reload(job_id, collection, docs_path):
+    job = reload_jobs[job_id]
+    try:
+        collection_store.reload(collection, docs_path=docs_path)
+    except Exception as e:
+        job.update(state="failed", error=str(e), finished=time.time())
+        print(f"Reload of {collection} failed: {e}")
+        return
+    job.update(state="done", finished=time.time())
+    if collection == DEFAULT_COLLECTION:
+        set_index_state("ready")
+    print(f"Collection {collection} reloaded and swapped in")
+
+@app.post("/admin/reload", status_code=202, dependencies=[Depends(require_admin)])
+async def reload_collection(request: ReloadRequest):
+    with reload_lock:
+        if any(j["collection"] == request.collection and j["state"] == "running" for j in reload_jobs.values()):
+            raise HTTPException(status_code=409, detail=f"A reload of {request.collection} is already running")
+        job_id = uuid.uuid4().hex
+        reload_jobs[job_id] = {
+            "id": job_id,
+            "collection": request.collection,
+            "docs_path": request.docs_path,
+            "state": "running",
+            "error": None,
+            "started": time.time(),
+            "finished": None
+        }
+    threading.Thread(
+        target=run_reload, args=(job_id, request.collection, request.docs_path),
+        name=f"reload-{request.collection}", daemon=True
+    ).start()
+    return reload_jobs[job_id]
+
+@app.get("/admin/reload/{job_id}", dependencies=[Depends(require_admin)])
+async def reload_status(job_id: str):
+    if job_id not in reload_jobs:
+        raise HTTPException(status_code=404, detail="Reload job not found")
+    return reload_jobs[job_id]
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
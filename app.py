@@ -1,16 +1,20 @@
 import gradio as gr
 import requests
+import json
 import os
+import time
 
 API_URL = os.getenv("API_URL", "http://localhost:8000")  # Use env var
 
 class RAGInterface:
     def __init__(self):
+        # One pooled keep-alive session for every call to the API
+        self.session = requests.Session()
         self.models = self.get_available_models()
     
     def get_available_models(self):
         try:
-            response = requests.get(f"{API_URL}/models")
+            response = self.session.get(f"{API_URL}/models")
             return response.json()["models"]
         except:
             return ["qwen2.5:7b", "codellama:7b-instruct", "deepseek-r1:7b", "phi3:mini"]
@@ -20,13 +24,14 @@ class RAGInterface:
             return "Please enter a question.", ""
         
         try:
-            response = requests.post(
+            response = self.session.post(
                 f"{API_URL}/query",
                 json={
                     "question": question,
                     "models": [model],
                     "k": num_sources,
-                    "parallel": False
+                    "parallel": False,
+                    "format": "compact"
                 }
             )
             data = response.json()
@@ -38,53 +43,102 @@ class RAGInterface:
             answer += f"- Speed: {result['metrics']['tokens_per_second']} tokens/sec\n\n"
             
             sources = "**Retrieved Sources:**\n\n"
-            for i, source in enumerate(result['sources'], 1):
-                clean_source = source.replace('\ufeff', '').strip()
+            for i, source_id in enumerate(result['source_ids'], 1):
+                clean_source = data['sources'][source_id].replace('\ufeff', '').strip()
                 sources += f"{i}. {clean_source}...\n\n"
             
             return answer, sources
         except Exception as e:
             return f"Error: {str(e)}", ""
     
+    def render_progress(self, question, states, total_time=None):
+        results_text = f"# Question: {question}\n\n"
+        if total_time is None:
+            results_text += f"**Streaming... {sum(1 for st in states.values() if st['done'])}/{len(states)} models finished**\n\n"
+        else:
+            results_text += f"**Total Time (Parallel): {total_time}s**\n\n"
+        results_text += "=" * 80 + "\n\n"
+        
+        # Finished models first (by finish time), then streaming models by time-to-first-token
+        sorted_states = sorted(
+            states.items(),
+            key=lambda x: (
+                not x[1]["done"],
+                x[1]["time"] if x[1]["done"] else (x[1]["ttft"] if x[1]["ttft"] is not None else float("inf"))
+            )
+        )
+        
+        for model, state in sorted_states:
+            ttft = f"{state['ttft']}s" if state["ttft"] is not None else "waiting"
+            results_text += f"## {model}{'' if state['done'] else ' (streaming)'}\n"
+            if state["done"]:
+                results_text += f"**Time:** {state['time']}s | "
+            results_text += f"**First token:** {ttft} | "
+            results_text += f"**Speed:** {state['tokens_per_second']} tokens/sec | "
+            results_text += f"**Tokens:** {state['tokens']}\n\n"
+            results_text += f"**Answer:**\n{state['answer']}\n\n"
+            results_text += "-" * 80 + "\n\n"
+        
+        return results_text
+    
     def query_compare(self, question, models_selected, num_sources):
         if not question.strip():
-            return "Please enter a question."
+            yield "Please enter a question."
+            return
         
         if not models_selected:
-            return "Please select at least one model."
+            yield "Please select at least one model."
+            return
+        
+        states = {
+            model: {"answer": "", "ttft": None, "tokens": 0, "tokens_per_second": 0, "time": None, "done": False}
+            for model in models_selected
+        }
         
         try:
-            response = requests.post(
-                f"{API_URL}/query",
+            response = self.session.post(
+                f"{API_URL}/query/stream",
                 json={
                     "question": question,
                     "models": models_selected,
-                    "k": num_sources,
-                    "parallel": True
-                }
-            )
-            data = response.json()
-            
-            results_text = f"# Question: {question}\n\n"
-            results_text += f"**Total Time (Parallel): {data['total_time']}s**\n\n"
-            results_text += "=" * 80 + "\n\n"
-            
-            sorted_results = sorted(
-                data["results"].items(), 
-                key=lambda x: x[1]["time"]
+                    "k": num_sources
+                },
+                stream=True
             )
+            response.raise_for_status()
             
-            for model, result in sorted_results:
-                results_text += f"## {model}\n"
-                results_text += f"**Time:** {result['time']}s | "
-                results_text += f"**Speed:** {result['metrics']['tokens_per_second']} tokens/sec | "
-                results_text += f"**Words:** {result['metrics']['word_count']}\n\n"
-                results_text += f"**Answer:**\n{result['answer']}\n\n"
-                results_text += "-" * 80 + "\n\n"
-            
-            return results_text
+            last_render = 0
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                event = json.loads(line)
+                
+                if event["event"] == "token":
+                    state = states[event["model"]]
+                    state["answer"] += event["content"]
+                    state["tokens"] = event["tokens"]
+                    state["ttft"] = event["ttft"]
+                    generating = event["elapsed"] - event["ttft"]
+                    state["tokens_per_second"] = round(event["tokens"] / generating, 2) if generating > 0 else 0
+                elif event["event"] == "done":
+                    state = states[event["model"]]
+                    result = event["result"]
+                    state["done"] = True
+                    state["answer"] = result["answer"]
+                    state["time"] = result["time"]
+                    if result["metrics"].get("ttft") is not None:
+                        state["ttft"] = result["metrics"]["ttft"]
+                elif event["event"] == "end":
+                    yield self.render_progress(question, states, total_time=event["total_time"])
+                    return
+                
+                # Throttle UI updates while tokens are pouring in
+                now = time.time()
+                if event["event"] != "token" or now - last_render > 0.1:
+                    last_render = now
+                    yield self.render_progress(question, states)
         except Exception as e:
-            return f"Error: {str(e)}"
+            yield f"Error: {str(e)}"
 
 def create_interface():
     rag_interface = RAGInterface()
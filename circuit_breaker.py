@@ -0,0 +1,94 @@
+import os
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Fails fast after repeated errors and lets a few probe calls through once
+    the recovery timeout has passed (half-open) before closing again."""
+
+    def __init__(self, name, failure_threshold=3, recovery_timeout=30.0, half_open_max_calls=1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.half_open_calls = 0
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == OPEN:
+                if time.time() - self.opened_at < self.recovery_timeout:
+                    return False
+                self.state = HALF_OPEN
+                self.half_open_calls = 0
+            if self.state == HALF_OPEN:
+                if self.half_open_calls >= self.half_open_max_calls:
+                    return False
+                self.half_open_calls += 1
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.half_open_calls = 0
+            self.last_error = None
+
+    def record_failure(self, error=None):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error) if error is not None else None
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.time()
+
+    def release(self):
+        # The call was abandoned before it showed whether the model works; free the
+        # half-open probe slot without recording an outcome
+        with self._lock:
+            if self.state == HALF_OPEN and self.half_open_calls > 0:
+                self.half_open_calls -= 1
+
+    def status(self):
+        with self._lock:
+            retry_in = None
+            if self.state == OPEN:
+                retry_in = round(max(0.0, self.recovery_timeout - (time.time() - self.opened_at)), 2)
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "retry_in": retry_in,
+                "last_error": self.last_error
+            }
+
+
+class CircuitBreakerRegistry:
+    def __init__(self, failure_threshold=None, recovery_timeout=None):
+        self.failure_threshold = failure_threshold or int(os.getenv("BREAKER_FAILURE_THRESHOLD", "3"))
+        self.recovery_timeout = recovery_timeout or float(os.getenv("BREAKER_RECOVERY_TIMEOUT", "30"))
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            if name not in self._breakers:
+                self._breakers[name] = CircuitBreaker(
+                    name,
+                    failure_threshold=self.failure_threshold,
+                    recovery_timeout=self.recovery_timeout
+                )
+            return self._breakers[name]
+
+    def status(self):
+        with self._lock:
+            breakers = list(self._breakers.items())
+        return {name: breaker.status() for name, breaker in breakers}
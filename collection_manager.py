@@ -0,0 +1,275 @@
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+DEFAULT_COLLECTION = "default"
+COLLECTION_NAME = re.compile(r"^[A-Za-z0-9_-]+$")
+# Rebuilt indexes are written to <collection>/versions/<version>/ and made live by
+# rewriting <collection>/CURRENT, so the collection directory itself (possibly a
+# bind mount) is never renamed
+CURRENT_FILE = "CURRENT"
+VERSIONS_DIR = "versions"
+
+
+def resolve_index_path(path):
+    """Directory holding a collection's live index files."""
+    pointer = os.path.join(path, CURRENT_FILE)
+    if os.path.exists(pointer):
+        with open(pointer, encoding="utf-8") as f:
+            return os.path.join(path, f.read().strip())
+    return path
+
+
+def has_index(path):
+    return os.path.exists(os.path.join(resolve_index_path(path), "index.faiss"))
+
+
+class CollectionNotFound(Exception):
+    pass
+
+
+class _Entry:
+    def __init__(self, rag, in_use):
+        self.rag = rag
+        # The index itself does not change once loaded; only the caches grow
+        self.index_bytes = rag.index_bytes()
+        self.size = rag.memory_bytes(self.index_bytes)
+        self.in_use = in_use
+
+
+class CollectionManager:
+    """Loads named vectorstores on first use and evicts the least recently used
+    idle ones once their estimated footprint exceeds the memory budget.
+
+    Concurrent first requests for the same collection wait on a single load.
+    """
+
+    def __init__(self, rag_factory, base_dir="collections", default_path="vectorstore", memory_budget_bytes=4 << 30):
+        self.rag_factory = rag_factory
+        self.base_dir = base_dir
+        self.default_path = default_path
+        self.memory_budget_bytes = memory_budget_bytes
+        self._loaded = OrderedDict()
+        self._loading = {}
+        # Swapped-out entries still serving in-flight queries; closed when the last lease ends
+        self._retired = []
+        self._pinned = set()
+        self._lock = threading.Lock()
+
+    def path_for(self, name):
+        if name == DEFAULT_COLLECTION:
+            return self.default_path
+        if not COLLECTION_NAME.match(name):
+            raise CollectionNotFound(f"Invalid collection name: {name}")
+        return os.path.join(self.base_dir, name)
+
+    def available(self):
+        names = []
+        if has_index(self.default_path):
+            names.append(DEFAULT_COLLECTION)
+        if os.path.isdir(self.base_dir):
+            names.extend(sorted(
+                name for name in os.listdir(self.base_dir)
+                if COLLECTION_NAME.match(name) and has_index(os.path.join(self.base_dir, name))
+            ))
+        return names
+
+    def acquire(self, name):
+        with self._lock:
+            entry = self._loaded.get(name)
+            if entry is not None:
+                entry.in_use += 1
+                self._loaded.move_to_end(name)
+                return entry.rag
+            loading = self._loading.get(name)
+            if loading is not None:
+                loading["waiters"] += 1
+                future = loading["future"]
+            else:
+                future = Future()
+                self._loading[name] = {"future": future, "waiters": 0}
+
+        if loading is not None:
+            return future.result()
+
+        try:
+            path = self.path_for(name)
+            if not has_index(path):
+                raise CollectionNotFound(f"Collection not found: {name}")
+            rag = self.rag_factory()
+            rag.load_vectorstore(path)
+        except Exception as e:
+            with self._lock:
+                del self._loading[name]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            waiters = self._loading.pop(name)["waiters"]
+            self._loaded[name] = _Entry(rag, in_use=1 + waiters)
+            evicted = self._evict()
+        future.set_result(rag)
+        self._close(evicted)
+        return rag
+
+    def pin(self, name):
+        # Pinned collections are never evicted (used for the default collection)
+        with self._lock:
+            self._pinned.add(name)
+
+    def is_loaded(self, name):
+        with self._lock:
+            return name in self._loaded
+
+    def swap(self, name, rag):
+        """Atomically replace a collection with an already-loaded RAGSystem.
+
+        Queries that hold a lease on the old one finish on it; it is closed once
+        the last of them releases it.
+        """
+        while True:
+            with self._lock:
+                loading = self._loading.get(name)
+                if loading is None:
+                    old = self._loaded.pop(name, None)
+                    self._loaded[name] = _Entry(rag, in_use=0)
+                    if old is not None and old.in_use > 0:
+                        self._retired.append((name, old))
+                        old = None
+                    evicted = self._evict()
+                    break
+            # A first load of this collection is still running; let it land so the
+            # swap replaces it instead of being overwritten by it
+            try:
+                loading["future"].result()
+            except Exception:
+                pass
+        if old is not None:
+            evicted.append((name, old))
+        self._close(evicted)
+
+    def reload(self, name, docs_path=None):
+        """Load a fresh copy of a collection next to the serving one and swap it in.
+
+        With docs_path the index is rebuilt from documents into a new version
+        directory inside the collection, loaded, and then made current.
+        """
+        path = self.path_for(name)
+        if not docs_path:
+            if not has_index(path):
+                raise CollectionNotFound(f"Collection not found: {name}")
+            rag = self.rag_factory()
+            rag.load_vectorstore(path)
+            self.swap(name, rag)
+            return rag
+
+        os.makedirs(os.path.join(path, VERSIONS_DIR), exist_ok=True)
+        # mkdtemp keeps a new version from ever reusing the name of the live one
+        staging = tempfile.mkdtemp(prefix=time.strftime("%Y%m%d_%H%M%S_"), dir=os.path.join(path, VERSIONS_DIR))
+        version = os.path.basename(staging)
+        promoted = False
+        try:
+            builder = self.rag_factory()
+            try:
+                builder.load_documents(docs_path)
+                builder.save_vectorstore(staging)
+            finally:
+                builder.close()
+            rag = self.rag_factory()
+            rag.load_vectorstore(staging)
+            self._set_current(path, f"{VERSIONS_DIR}/{version}")
+            promoted = True
+        finally:
+            if not promoted:
+                shutil.rmtree(staging, ignore_errors=True)
+
+        self.swap(name, rag)
+        # In-flight queries keep the old index in memory (open memory maps keep its files readable)
+        for old in os.listdir(os.path.join(path, VERSIONS_DIR)):
+            if old != version:
+                shutil.rmtree(os.path.join(path, VERSIONS_DIR, old), ignore_errors=True)
+        return rag
+
+    def _set_current(self, path, version_dir):
+        pointer = os.path.join(path, CURRENT_FILE)
+        with open(f"{pointer}.tmp", "w", encoding="utf-8") as f:
+            f.write(version_dir)
+        os.replace(f"{pointer}.tmp", pointer)
+
+    def release(self, name, rag):
+        with self._lock:
+            entry = self._loaded.get(name)
+            if entry is None or entry.rag is not rag:
+                retired = self._release_retired(rag)
+                if retired is not None:
+                    self._close([retired])
+                return
+            entry.in_use -= 1
+            # Caches grow with use, so refresh the footprint when a query finishes
+            entry.size = rag.memory_bytes(entry.index_bytes)
+            evicted = self._evict()
+        self._close(evicted)
+
+    @contextmanager
+    def lease(self, name):
+        rag = self.acquire(name)
+        try:
+            yield rag
+        finally:
+            self.release(name, rag)
+
+    def _release_retired(self, rag):
+        # Caller holds the lock
+        for i, (name, entry) in enumerate(self._retired):
+            if entry.rag is rag:
+                entry.in_use -= 1
+                if entry.in_use == 0:
+                    return self._retired.pop(i)
+                return None
+        return None
+
+    def _evict(self):
+        # Caller holds the lock; only idle collections are evicted, oldest first
+        evicted = []
+        total = sum(entry.size for entry in self._loaded.values())
+        for name in list(self._loaded):
+            if total <= self.memory_budget_bytes:
+                break
+            entry = self._loaded[name]
+            if entry.in_use == 0 and name not in self._pinned:
+                del self._loaded[name]
+                total -= entry.size
+                evicted.append((name, entry))
+        return evicted
+
+    def _close(self, evicted):
+        for name, entry in evicted:
+            entry.rag.close()
+            print(f"Released collection {name} ({entry.size / 1e6:.1f} MB)")
+
+    def loaded(self):
+        with self._lock:
+            return {name: entry.rag for name, entry in self._loaded.items()}
+
+    def status(self):
+        with self._lock:
+            loaded = {
+                name: {"memory_bytes": entry.size, "in_use": entry.in_use}
+                for name, entry in self._loaded.items()
+            }
+            loading = sorted(self._loading)
+            retired = [{"name": name, "in_use": entry.in_use} for name, entry in self._retired]
+        return {
+            "memory_budget_bytes": self.memory_budget_bytes,
+            "memory_bytes": sum(c["memory_bytes"] for c in loaded.values()),
+            "loaded": loaded,
+            "loading": loading,
+            "retired": retired,
+            "available": self.available()
+        }
@@ -1,12 +1,16 @@
 from rag_system import RAGSystem
+from circuit_breaker import CircuitBreakerRegistry
+import queue
+import threading
 import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import statistics
 
 class ModelComparison:
-    def __init__(self, models_list):
+    def __init__(self, models_list, rag=None, breakers=None):
         self.models = models_list
-        self.rag = RAGSystem()
+        self.rag = rag if rag is not None else RAGSystem()
+        self.breakers = breakers if breakers is not None else CircuitBreakerRegistry()
         
     def setup(self, docs_path=None, vectorstore_path="vectorstore"):
         if docs_path:
@@ -15,42 +19,171 @@ class ModelComparison:
         else:
             self.rag.load_vectorstore(vectorstore_path)
     
-    def query_single_model(self, model, question, k):
+    def _result(self, model, answer, elapsed, sources, cache, usage):
+        word_count = len(answer.split())
+        char_count = len(answer)
+        
+        return {
+            "model": model,
+            "answer": answer,
+            "time": round(elapsed, 2),
+            "time_ms": round(elapsed * 1000, 1),
+            "status": "ok",
+            "sources": sources,
+            "cache": cache,
+            "usage": usage,
+            "metrics": {
+                "response_length": char_count,
+                "word_count": word_count,
+                "tokens_per_second": round(word_count / elapsed, 2) if elapsed > 0 else 0
+            }
+        }
+    
+    def _error_result(self, model, answer, status, failed_after=None):
+        result = {
+            "model": model,
+            "answer": answer,
+            "time": 0,
+            "status": status,
+            "sources": [],
+            "metrics": {"response_length": 0, "word_count": 0, "tokens_per_second": 0}
+        }
+        if failed_after is not None:
+            result["failed_after"] = round(failed_after, 2)
+        return result
+    
+    def query_single_model(self, model, question, k, filters=None):
         start_time = time.time()
         try:
-            result = self.rag.query(question, model_name=model, k=k)
+            docs, cache = self.rag.retrieve(question, k=k, filters=filters)
+        except Exception as e:
+            # Retrieval problems are not the model's fault, so they stay out of its breaker
+            return self._error_result(model, f"Error: {str(e)}", "error", failed_after=time.time() - start_time)
+        return self.answer_single_model(model, question, docs, cache, retrieval_time=time.time() - start_time)
+    
+    def answer_single_model(self, model, question, docs, cache, retrieval_time=0.0):
+        # Reported times include retrieval, which may have been shared with other models
+        start_time = time.time() - retrieval_time
+        breaker = self.breakers.get(model)
+        if not breaker.allow():
+            return self._error_result(
+                model, f"Error: circuit open for {model}, skipping until it recovers", "circuit_open"
+            )
+        
+        try:
+            result = self.rag.answer(question, docs, model_name=model)
+        except Exception as e:
+            breaker.record_failure(e)
+            return self._error_result(model, f"Error: {str(e)}", "error", failed_after=time.time() - start_time)
+        elapsed = time.time() - start_time
+        breaker.record_success()
+        return self._result(
+            model, result["answer"], elapsed, [doc.page_content[:200] for doc in docs], cache, result["usage"]
+        )
+    
+    def stream_single_model(self, model, question, docs, cache, emit, cancel):
+        breaker = self.breakers.get(model)
+        if not breaker.allow():
+            emit({"event": "done", "model": model, "result": self._error_result(
+                model, f"Error: circuit open for {model}, skipping until it recovers", "circuit_open"
+            )})
+            return
+        
+        start_time = time.time()
+        first_token = None
+        parts = []
+        usage = {"prompt_tokens": None, "completion_tokens": None}
+        stream = self.rag.stream_answer(question, docs, model_name=model, cancel=cancel)
+        try:
+            for chunk in stream:
+                if cancel.is_set():
+                    break
+                content = chunk["message"]["content"]
+                if content:
+                    now = time.time()
+                    if first_token is None:
+                        first_token = now
+                    parts.append(content)
+                    emit({
+                        "event": "token",
+                        "model": model,
+                        "content": content,
+                        "tokens": len(parts),
+                        "ttft": round(first_token - start_time, 3),
+                        "elapsed": round(now - start_time, 3)
+                    })
+                if chunk.get("done", False):
+                    usage = {
+                        "prompt_tokens": chunk.get("prompt_eval_count", None),
+                        "completion_tokens": chunk.get("eval_count", None)
+                    }
             elapsed = time.time() - start_time
-            
-            answer = result["answer"]
-            word_count = len(answer.split())
-            char_count = len(answer)
-            
-            return {
-                "model": model,
-                "answer": answer,
-                "time": round(elapsed, 2),
-                "sources": result["sources"],
-                "metrics": {
-                    "response_length": char_count,
-                    "word_count": word_count,
-                    "tokens_per_second": round(word_count / elapsed, 2) if elapsed > 0 else 0
-                }
-            }
+            if cancel.is_set():
+                # A partial answer says nothing about the model's health
+                breaker.release()
+                result = self._error_result(model, "".join(parts), "cancelled", failed_after=elapsed)
+            else:
+                breaker.record_success()
+                result = self._result(
+                    model, "".join(parts), elapsed, [doc.page_content[:200] for doc in docs], cache, usage
+                )
+                result["metrics"]["ttft"] = round(first_token - start_time, 3) if first_token else None
+        except Exception as e:
+            if cancel.is_set():
+                breaker.release()
+            else:
+                breaker.record_failure(e)
+            result = self._error_result(model, f"Error: {str(e)}", "error", failed_after=time.time() - start_time)
+        finally:
+            stream.close()
+        emit({"event": "done", "model": model, "result": result})
+    
+    def stream_compare(self, question, k=3, filters=None, cancel=None):
+        """Yield retrieval, per-token and per-model completion events as models answer.
+        
+        Setting cancel (or closing the generator) stops every model still streaming.
+        """
+        docs, cache = self.rag.retrieve(question, k=k, filters=filters)
+        yield {"event": "sources", "sources": [doc.page_content[:200] for doc in docs], "cache": cache}
+        
+        events = queue.Queue()
+        cancel = cancel if cancel is not None else threading.Event()
+        executor = ThreadPoolExecutor(max_workers=len(self.models))
+        try:
+            for model in self.models:
+                executor.submit(self.stream_single_model, model, question, docs, cache, events.put, cancel)
+            remaining = len(self.models)
+            while remaining and not cancel.is_set():
+                try:
+                    event = events.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if event["event"] == "done":
+                    remaining -= 1
+                yield event
+        finally:
+            # Each model's stream closes its Ollama connection once it sees cancel
+            cancel.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    def compare(self, question, k=3, parallel=True, filters=None):
+        # Retrieve once for every model; parallel per-model retrievals would all miss the cache together
+        start_time = time.time()
+        try:
+            docs, cache = self.rag.retrieve(question, k=k, filters=filters)
         except Exception as e:
+            failed_after = time.time() - start_time
             return {
-                "model": model,
-                "answer": f"Error: {str(e)}",
-                "time": 0,
-                "sources": [],
-                "metrics": {"response_length": 0, "word_count": 0, "tokens_per_second": 0}
+                model: self._error_result(model, f"Error: {str(e)}", "error", failed_after=failed_after)
+                for model in self.models
             }
-    
-    def compare(self, question, k=3, parallel=True):
+        retrieval_time = time.time() - start_time
+        
         if parallel:
             results = {}
             with ThreadPoolExecutor(max_workers=len(self.models)) as executor:
                 future_to_model = {
-                    executor.submit(self.query_single_model, model, question, k): model 
+                    executor.submit(self.answer_single_model, model, question, docs, cache, retrieval_time): model 
                     for model in self.models
                 }
                 
@@ -64,7 +197,7 @@ class ModelComparison:
             results = {}
             for model in self.models:
                 print(f"\nQuerying {model}...")
-                results[model] = self.query_single_model(model, question, k)
+                results[model] = self.answer_single_model(model, question, docs, cache, retrieval_time)
             return results
     
     def print_comparison(self, results):
@@ -0,0 +1,193 @@
+import argparse
+import json
+import os
+import faiss
+import numpy as np
+from collection_manager import resolve_index_path
+
+VECTORS_FILE = "vectors.f32.npy"
+VECTORS_META_FILE = "vectors.json"
+BLOCK_ROWS = 65536
+
+
+def parse_scheme(spec):
+    # "float16", "int8" or "pca:<dims>"
+    name, _, dims = spec.partition(":")
+    if name not in ("float16", "int8", "pca"):
+        raise ValueError(f"Unknown compression scheme: {spec}")
+    if name == "pca":
+        return name, int(dims) if dims else 128
+    return name, None
+
+
+def write_full_vectors(faiss_index, path, index_version=None):
+    """Copy the float32 vectors out of a flat FAISS index into an on-disk .npy file.
+
+    Both files are written beside their final names and moved into place, so a
+    CompressedVectorIndex still mapping the previous file keeps reading it intact.
+    """
+    n, d = faiss_index.ntotal, faiss_index.d
+    vectors_path = os.path.join(path, VECTORS_FILE)
+    tmp_path = f"{vectors_path}.tmp-{os.getpid()}"
+    try:
+        full = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(n, d))
+        for start in range(0, n, BLOCK_ROWS):
+            count = min(BLOCK_ROWS, n - start)
+            full[start:start + count] = faiss_index.reconstruct_n(start, count)
+        full.flush()
+        del full
+        os.replace(tmp_path, vectors_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    meta_path = os.path.join(path, VECTORS_META_FILE)
+    meta_tmp_path = f"{meta_path}.tmp-{os.getpid()}"
+    with open(meta_tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"index_version": index_version, "ntotal": n, "dim": d}, f)
+    os.replace(meta_tmp_path, meta_path)
+    return vectors_path
+
+
+def full_vectors_current(path, index_version):
+    meta_path = os.path.join(path, VECTORS_META_FILE)
+    if not os.path.exists(meta_path) or not os.path.exists(os.path.join(path, VECTORS_FILE)):
+        return False
+    with open(meta_path, encoding="utf-8") as f:
+        return json.load(f).get("index_version") == index_version
+
+
+class CompressedVectorIndex:
+    """Two-stage L2 search: a FAISS scan over compressed vectors held in RAM, then
+    exact re-ranking of the best candidates against the full-precision vectors,
+    which stay in a memory-mapped file."""
+
+    def __init__(self, vectors_path, scheme="int8", rerank_factor=4):
+        self.scheme, self.dims = parse_scheme(scheme)
+        self.scheme_spec = scheme
+        self.rerank_factor = rerank_factor
+        self.full = np.load(vectors_path, mmap_mode="r")
+        self.ntotal, self.dim = self.full.shape
+        getattr(self, f"_build_{self.scheme}")()
+
+    @staticmethod
+    def _blocks(matrix):
+        for start in range(0, len(matrix), BLOCK_ROWS):
+            yield start, np.asarray(matrix[start:start + BLOCK_ROWS], dtype=np.float32)
+
+    def _add_blocks(self, transform=None):
+        for _, block in self._blocks(self.full):
+            self.first_pass.add(block if transform is None else transform(block))
+
+    def _build_float16(self):
+        self.first_pass = faiss.IndexScalarQuantizer(self.dim, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_L2)
+        self._add_blocks()
+
+    def _build_int8(self):
+        lo = np.full(self.dim, np.inf, dtype=np.float32)
+        hi = np.full(self.dim, -np.inf, dtype=np.float32)
+        for _, block in self._blocks(self.full):
+            lo = np.minimum(lo, block.min(axis=0))
+            hi = np.maximum(hi, block.max(axis=0))
+        self.first_pass = faiss.IndexScalarQuantizer(self.dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_L2)
+        # The default min/max range statistic on these two rows gives the exact per-dimension range
+        self.first_pass.train(np.stack([lo, hi]))
+        self._add_blocks()
+
+    def _build_pca(self):
+        dims = min(self.dims, self.dim, self.ntotal)
+        sample_rows = np.linspace(0, self.ntotal - 1, min(self.ntotal, 20000)).astype(np.int64)
+        sample = np.asarray(self.full[sample_rows], dtype=np.float32)
+        self.mean = sample.mean(axis=0)
+        _, _, vt = np.linalg.svd(sample - self.mean, full_matrices=False)
+        self.components = np.ascontiguousarray(vt[:dims].T, dtype=np.float32)
+        self.first_pass = faiss.IndexFlatL2(dims)
+        self._add_blocks(self._reduce)
+
+    def _reduce(self, vectors):
+        if self.scheme != "pca":
+            return vectors
+        return np.ascontiguousarray((vectors - self.mean) @ self.components, dtype=np.float32)
+
+    def search(self, query, k, bitmap=None):
+        """bitmap, if given, is a little-endian packed bitmap of the ids allowed to match."""
+        query = np.asarray(query, dtype=np.float32).reshape(1, -1)
+        n_candidates = min(self.ntotal, k * self.rerank_factor)
+        if n_candidates == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        params = None
+        if bitmap is not None:
+            # The selector takes the bitmap's length in bytes
+            params = faiss.SearchParameters(sel=faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap)))
+        _, candidates = self.first_pass.search(self._reduce(query), n_candidates, params=params)
+        # FAISS pads with -1 when fewer ids pass the filter than were asked for
+        candidates = candidates[0][candidates[0] != -1]
+        if len(candidates) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        candidates.sort()
+        exact = self.full[candidates] - query
+        distances = np.einsum("ij,ij->i", exact, exact)
+        order = np.argsort(distances)[:k]
+        return candidates[order], distances[order]
+
+    def memory_bytes(self):
+        total = self.first_pass.sa_code_size() * self.first_pass.ntotal
+        for name in ("mean", "components"):
+            if hasattr(self, name):
+                total += getattr(self, name).nbytes
+        return total
+
+    def full_bytes(self):
+        return self.ntotal * self.dim * 4
+
+
+def exact_search(full, query, k):
+    distances = np.empty(len(full), dtype=np.float32)
+    for start in range(0, len(full), BLOCK_ROWS):
+        block = np.asarray(full[start:start + BLOCK_ROWS], dtype=np.float32) - query
+        distances[start:start + len(block)] = np.einsum("ij,ij->i", block, block)
+    k = min(k, len(full))
+    top = np.argpartition(distances, k - 1)[:k]
+    return top[np.argsort(distances[top])]
+
+
+def recall_at_k(index, queries, k):
+    found = 0
+    for query in queries:
+        expected = set(exact_search(index.full, query, k).tolist())
+        ids, _ = index.search(query, k)
+        found += len(expected & set(ids.tolist()))
+    return found / (len(queries) * min(k, index.ntotal))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure memory and recall@k of compressed vector search")
+    parser.add_argument("path", nargs="?", default="vectorstore")
+    parser.add_argument("--schemes", nargs="+", default=["float16", "int8", "pca:256", "pca:128"])
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--rerank-factor", type=int, default=4)
+    args = parser.parse_args()
+
+    path = resolve_index_path(args.path)
+    vectors_path = os.path.join(path, VECTORS_FILE)
+    if not os.path.exists(vectors_path):
+        write_full_vectors(faiss.read_index(os.path.join(path, "index.faiss")), path)
+
+    full = np.load(vectors_path, mmap_mode="r")
+    rng = np.random.default_rng(0)
+    rows = rng.choice(len(full), size=min(args.queries, len(full)), replace=False)
+    # Perturb stored vectors so queries are not exact copies of indexed rows
+    queries = np.asarray(full[rows], dtype=np.float32)
+    queries += rng.normal(scale=queries.std() * 0.1, size=queries.shape).astype(np.float32)
+
+    print(f"{'scheme':>10} {'RAM (MB)':>10} {'vs float32':>11} {f'recall@{args.k}':>10}")
+    for scheme in args.schemes:
+        index = CompressedVectorIndex(vectors_path, scheme=scheme, rerank_factor=args.rerank_factor)
+        print(f"{scheme:>10} {index.memory_bytes() / 1e6:>10.2f} "
+              f"{index.full_bytes() / index.memory_bytes():>10.1f}x {recall_at_k(index, queries, args.k):>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
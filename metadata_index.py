@@ -0,0 +1,153 @@
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+BITMAPS_FILE = "metadata_bitmaps.npz"
+MASK_CACHE_SIZE = 64
+
+
+def normalize_source(source):
+    return os.path.normpath(str(source)).replace("\\", "/")
+
+
+def filter_key(filters):
+    # Hashable, order-independent form of a filters dict (None when nothing is filtered)
+    if not filters:
+        return None
+    sources = filters.get("sources")
+    key = (
+        normalize_source(filters["source_prefix"]) if filters.get("source_prefix") else None,
+        tuple(sorted(normalize_source(s) for s in sources)) if sources else None,
+        filters.get("ingested_after"),
+        filters.get("ingested_before")
+    )
+    return None if key == (None, None, None, None) else key
+
+
+class MetadataBitmapIndex:
+    """Per-source bitmaps over FAISS ids (bit i set = vector i belongs to the source).
+
+    Bitmaps use little-endian bit order within each byte, the layout that
+    faiss.IDSelectorBitmap reads, so a filter's combined bitmap can be handed to
+    the index search directly.
+    """
+
+    def __init__(self, ntotal=0):
+        self.ntotal = ntotal
+        self.bitmaps = {}
+        self.ingested_at = {}
+        # Shared by the parallel per-model queries
+        self._mask_cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        return (self.ntotal + 7) // 8
+
+    @classmethod
+    def build(cls, vectorstore):
+        index = cls()
+        docs = [
+            vectorstore.docstore.search(vectorstore.index_to_docstore_id[i])
+            for i in range(vectorstore.index.ntotal)
+        ]
+        index.add(0, docs)
+        return index
+
+    def add(self, start_id, docs):
+        self.ntotal = max(self.ntotal, start_id + len(docs))
+        for source in self.bitmaps:
+            self._grow(source)
+        for offset, doc in enumerate(docs):
+            source = normalize_source(doc.metadata.get("source", ""))
+            if source not in self.bitmaps:
+                self.bitmaps[source] = np.zeros(self.nbytes, dtype=np.uint8)
+            i = start_id + offset
+            self.bitmaps[source][i >> 3] |= np.uint8(1 << (i & 7))
+            ingested_at = doc.metadata.get("ingested_at")
+            if ingested_at is not None:
+                self.ingested_at[source] = max(self.ingested_at.get(source, 0.0), float(ingested_at))
+        with self._lock:
+            self._mask_cache.clear()
+
+    def _grow(self, source):
+        bitmap = self.bitmaps[source]
+        if len(bitmap) < self.nbytes:
+            self.bitmaps[source] = np.concatenate([bitmap, np.zeros(self.nbytes - len(bitmap), dtype=np.uint8)])
+
+    def ids_for_source(self, source):
+        bitmap = self.bitmaps.get(normalize_source(source))
+        if bitmap is None:
+            return np.empty(0, dtype=np.int64)
+        return np.flatnonzero(np.unpackbits(bitmap, count=self.ntotal, bitorder="little"))
+
+    def matching_sources(self, filters):
+        prefix, sources, after, before = filter_key(filters)
+        matched = []
+        for source in self.bitmaps:
+            if prefix and not (source == prefix or source.startswith(prefix.rstrip("/") + "/")):
+                continue
+            if sources and source not in sources:
+                continue
+            if after is not None or before is not None:
+                ingested_at = self.ingested_at.get(source)
+                if ingested_at is None:
+                    continue
+                if after is not None and ingested_at < after:
+                    continue
+                if before is not None and ingested_at >= before:
+                    continue
+            matched.append(source)
+        return matched
+
+    def bitmap(self, filters):
+        """Packed bitmap of the ids matching filters, or None when unfiltered."""
+        key = filter_key(filters)
+        if key is None:
+            return None
+        with self._lock:
+            selected = self._mask_cache.get(key)
+            if selected is not None:
+                self._mask_cache.move_to_end(key)
+                return selected
+        selected = np.zeros(self.nbytes, dtype=np.uint8)
+        for source in self.matching_sources(filters):
+            np.bitwise_or(selected, self.bitmaps[source], out=selected)
+        with self._lock:
+            self._mask_cache[key] = selected
+            if len(self._mask_cache) > MASK_CACHE_SIZE:
+                self._mask_cache.popitem(last=False)
+        return selected
+
+    def memory_bytes(self):
+        return len(self.bitmaps) * self.nbytes
+
+    def save(self, path, index_version):
+        names = sorted(self.bitmaps)
+        np.savez(
+            os.path.join(path, BITMAPS_FILE),
+            index_version=np.array(index_version),
+            ntotal=np.int64(self.ntotal),
+            sources=np.array(names, dtype=str),
+            bitmaps=np.stack([self.bitmaps[n] for n in names]) if names else np.zeros((0, self.nbytes), np.uint8),
+            ingested_at=np.array([self.ingested_at.get(n, np.nan) for n in names], dtype=np.float64)
+        )
+
+    @classmethod
+    def load(cls, path, expected_ntotal, index_version):
+        """Load saved bitmaps, or None if missing or saved for a different index."""
+        file_path = os.path.join(path, BITMAPS_FILE)
+        if not os.path.exists(file_path):
+            return None
+        with np.load(file_path) as data:
+            if "index_version" not in data or str(data["index_version"]) != index_version:
+                return None
+            if int(data["ntotal"]) != expected_ntotal:
+                return None
+            index = cls(expected_ntotal)
+            for name, bitmap, ingested_at in zip(data["sources"], data["bitmaps"], data["ingested_at"]):
+                index.bitmaps[str(name)] = bitmap.copy()
+                if not np.isnan(ingested_at):
+                    index.ingested_at[str(name)] = float(ingested_at)
+        return index
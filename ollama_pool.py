@@ -0,0 +1,328 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from collections import deque
+import httpx
+import ollama
+from langchain_core.embeddings import Embeddings
+from prometheus_client import Counter, Gauge, Histogram
+
+# Prometheus metrics (per backend)
+backend_request_duration = Histogram(
+    'ollama_backend_request_duration_seconds', 'Ollama backend request duration', ['backend', 'operation']
+)
+backend_errors = Counter('ollama_backend_errors_total', 'Ollama backend request errors', ['backend', 'operation'])
+backend_outstanding = Gauge('ollama_backend_outstanding_requests', 'In-flight requests per Ollama backend', ['backend'])
+backend_healthy = Gauge('ollama_backend_healthy', 'Ollama backend health (1 = healthy)', ['backend'])
+hedged_requests = Counter('ollama_hedged_requests_total', 'Hedged chat requests by winner', ['model', 'winner'])
+
+def _model_names(response, key="models"):
+    names = set()
+    for m in response.get(key, None) or []:
+        name = m.get("model", None) or m.get("name", None)
+        if name:
+            names.add(name)
+    return names
+
+
+class OllamaBackend:
+    def __init__(self, host, timeout=120.0, max_connections=20, keepalive_expiry=60.0):
+        self.host = host
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        # ollama.Client keeps one httpx.Client per backend, so connections are reused across requests
+        self.client = ollama.Client(host=host, timeout=timeout, limits=limits)
+        # Used only on the pool's event loop, for calls that must be cancellable mid-request
+        self.async_client = ollama.AsyncClient(host=host, timeout=timeout, limits=limits)
+        # None until the first health check has run
+        self.healthy = None
+        self.available_models = set()
+        self.loaded_models = set()
+        self.outstanding = 0
+        self.last_error = None
+        self.last_check = None
+
+    def has_model(self, model):
+        # Before the first health check we do not know what the backend serves
+        if not self.available_models:
+            return True
+        return model in self.available_models or f"{model}:latest" in self.available_models
+
+    def is_loaded(self, model):
+        return model in self.loaded_models or f"{model}:latest" in self.loaded_models
+
+    def check_health(self):
+        try:
+            self.available_models = _model_names(self.client.list())
+            self.loaded_models = _model_names(self.client.ps())
+            self.healthy = True
+            self.last_error = None
+        except Exception as e:
+            self.healthy = False
+            self.last_error = str(e)
+        self.last_check = time.time()
+        backend_healthy.labels(backend=self.host).set(1 if self.healthy else 0)
+        return self.healthy
+
+    def status(self):
+        return {
+            "host": self.host,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "available_models": sorted(self.available_models),
+            "loaded_models": sorted(self.loaded_models),
+            "last_error": self.last_error,
+            "last_check": self.last_check
+        }
+
+
+class LatencyTracker:
+    def __init__(self, window=200, min_samples=20):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, key, seconds):
+        with self._lock:
+            self._samples.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, key, p):
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return samples[int(round(p / 100.0 * (len(samples) - 1)))]
+
+
+class OllamaPool:
+    """Routes chat and embedding calls across several Ollama servers.
+
+    A backend is picked by least outstanding requests among healthy backends that
+    serve the model, preferring backends that already have the model loaded.
+    """
+
+    def __init__(self, hosts, timeout=120.0, max_connections=20, health_interval=15.0, hedge_percentile=None):
+        if not hosts:
+            raise ValueError("At least one Ollama host is required")
+        self.backends = [
+            OllamaBackend(host, timeout=timeout, max_connections=max_connections) for host in hosts
+        ]
+        self.health_interval = health_interval
+        # Hedging: once a chat call runs past this percentile of the model's recent
+        # latencies, a duplicate goes to another backend and the slower one is cancelled
+        self.hedge_percentile = hedge_percentile
+        self.latencies = LatencyTracker()
+        self._loop = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._health_thread = None
+
+    @classmethod
+    def from_env(cls):
+        hosts = os.getenv("OLLAMA_HOSTS") or os.getenv("OLLAMA_HOST") or "http://localhost:11434"
+        return cls(
+            [h.strip() for h in hosts.split(",") if h.strip()],
+            timeout=float(os.getenv("OLLAMA_TIMEOUT", "120")),
+            max_connections=int(os.getenv("OLLAMA_MAX_CONNECTIONS", "20")),
+            health_interval=float(os.getenv("OLLAMA_HEALTH_INTERVAL", "15")),
+            hedge_percentile=float(os.getenv("OLLAMA_HEDGE_PERCENTILE")) if os.getenv("OLLAMA_HEDGE_PERCENTILE") else None
+        )
+
+    def start(self):
+        if self._health_thread and self._health_thread.is_alive():
+            return
+        self._stop.clear()
+        self._health_thread = threading.Thread(target=self._health_loop, name="ollama-health", daemon=True)
+        self._health_thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _health_loop(self):
+        # First check runs immediately in the background so a slow backend does not block startup
+        while True:
+            self.check_health()
+            if self._stop.wait(self.health_interval):
+                break
+
+    def check_health(self):
+        for backend in self.backends:
+            backend.check_health()
+
+    def status(self):
+        return [backend.status() for backend in self.backends]
+
+    def select_backend(self, model, exclude=()):
+        with self._lock:
+            candidates = [b for b in self.backends if b.healthy and b not in exclude]
+            # Fall back to unhealthy backends rather than failing outright; the call itself decides.
+            # A hedge (exclude given) only goes to another healthy replica of the model.
+            if not candidates and not exclude:
+                candidates = list(self.backends)
+            serving = [b for b in candidates if b.has_model(model)]
+            if not serving and exclude:
+                return None
+            serving = serving or candidates
+            if not serving:
+                return None
+            loaded = [b for b in serving if b.is_loaded(model)]
+            backend = min(loaded or serving, key=lambda b: b.outstanding)
+            backend.outstanding += 1
+        backend_outstanding.labels(backend=backend.host).set(backend.outstanding)
+        return backend
+
+    def _release(self, backend):
+        with self._lock:
+            backend.outstanding -= 1
+        backend_outstanding.labels(backend=backend.host).set(backend.outstanding)
+
+    def _call(self, operation, model, fn):
+        return self._run(self.select_backend(model), operation, model, fn)
+
+    def _run(self, backend, operation, model, fn):
+        start = time.time()
+        try:
+            result = fn(backend.client)
+            # A successful generation means the model is now resident on this backend
+            backend.loaded_models.add(model)
+            return result
+        except Exception:
+            backend_errors.labels(backend=backend.host, operation=operation).inc()
+            raise
+        finally:
+            backend_request_duration.labels(backend=backend.host, operation=operation).observe(time.time() - start)
+            self._release(backend)
+
+    def chat(self, model, messages, **kwargs):
+        start = time.time()
+        hedge_after = None
+        if self.hedge_percentile is not None and len(self.backends) > 1:
+            hedge_after = self.latencies.percentile(model, self.hedge_percentile)
+        if hedge_after is None:
+            response = self._call("chat", model, lambda client: client.chat(model=model, messages=messages, **kwargs))
+        else:
+            response = self._hedged_chat(model, messages, hedge_after, **kwargs)
+        self.latencies.record(model, time.time() - start)
+        return response
+
+    def chat_stream(self, model, messages, cancel=None, **kwargs):
+        """Yield chat chunks from one backend; setting cancel (or closing the
+        generator) closes the connection within a poll interval, which makes Ollama
+        stop generating even while it is still evaluating the prompt."""
+        chunks = queue.Queue()
+        future = asyncio.run_coroutine_threadsafe(
+            self._stream_async(self.select_backend(model), model, messages, chunks, **kwargs), self._event_loop()
+        )
+        try:
+            while cancel is None or not cancel.is_set():
+                try:
+                    kind, value = chunks.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if kind == "done":
+                    return
+                if kind == "error":
+                    raise value
+                yield value
+        finally:
+            future.cancel()
+
+    async def _stream_async(self, backend, model, messages, chunks, **kwargs):
+        start = time.time()
+        try:
+            stream = await backend.async_client.chat(model=model, messages=messages, stream=True, **kwargs)
+            async for chunk in stream:
+                chunks.put(("chunk", chunk))
+            backend.loaded_models.add(model)
+            self.latencies.record(model, time.time() - start)
+            chunks.put(("done", None))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            backend_errors.labels(backend=backend.host, operation="chat").inc()
+            chunks.put(("error", e))
+        finally:
+            backend_request_duration.labels(backend=backend.host, operation="chat").observe(time.time() - start)
+            self._release(backend)
+
+    def _event_loop(self):
+        # One long-lived loop shared by every cancellable call (hedged chats and streams), so the per-backend
+        # AsyncClients keep their connections alive between requests
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="ollama-async", daemon=True).start()
+            return self._loop
+
+    def _hedged_chat(self, model, messages, hedge_after, **kwargs):
+        # Cancelling the losing task closes its connection straight away, which makes
+        # Ollama abort the generation even while it is still evaluating the prompt.
+        # Hedging applies to non-streaming chat only; chat_stream always uses one backend.
+        future = asyncio.run_coroutine_threadsafe(
+            self._hedged_chat_async(model, messages, hedge_after, **kwargs), self._event_loop()
+        )
+        try:
+            return future.result()
+        finally:
+            future.cancel()
+
+    async def _attempt(self, backend, model, messages, **kwargs):
+        start = time.time()
+        try:
+            response = await backend.async_client.chat(model=model, messages=messages, **kwargs)
+            backend.loaded_models.add(model)
+            return response
+        except Exception:
+            backend_errors.labels(backend=backend.host, operation="chat").inc()
+            raise
+        finally:
+            backend_request_duration.labels(backend=backend.host, operation="chat").observe(time.time() - start)
+            self._release(backend)
+
+    async def _hedged_chat_async(self, model, messages, hedge_after, **kwargs):
+        primary_backend = self.select_backend(model)
+        primary = asyncio.ensure_future(self._attempt(primary_backend, model, messages, **kwargs))
+        attempts = [primary]
+        done, _ = await asyncio.wait(attempts, timeout=hedge_after)
+        if not done:
+            backend = self.select_backend(model, exclude=(primary_backend,))
+            if backend is not None:
+                attempts.append(asyncio.ensure_future(self._attempt(backend, model, messages, **kwargs)))
+
+        pending = set(attempts)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()
+                    continue
+                for other in pending:
+                    other.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+                if len(attempts) > 1:
+                    hedged_requests.labels(model=model, winner="primary" if task is primary else "hedge").inc()
+                return task.result()
+        raise error
+
+    def embed(self, model, texts):
+        response = self._call("embed", model, lambda client: client.embed(model=model, input=texts))
+        return response["embeddings"]
+
+
+class PooledOllamaEmbeddings(Embeddings):
+    def __init__(self, pool, model="nomic-embed-text"):
+        self.pool = pool
+        self.model = model
+
+    def embed_documents(self, texts):
+        return [list(v) for v in self.pool.embed(self.model, texts)]
+
+    def embed_query(self, text):
+        return list(self.pool.embed(self.model, [text])[0])
@@ -0,0 +1,212 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+import mlflow
+from circuit_breaker import CircuitBreakerRegistry
+from compare_models import ModelComparison
+from mlflow_tracking import MLflowRAGTracker
+from rag_system import RAGSystem
+
+# Fixed question set; each question names the file that should be retrieved for it
+DEFAULT_QUESTIONS = {
+    "What is machine learning?": "ml.txt",
+    "What is RAG?": "rag.txt",
+    "Explain vector embeddings": "embeddings.txt"
+}
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[int(round(p / 100.0 * (len(values) - 1)))]
+
+def directory_bytes(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+def pareto_front(summaries, cost_key="latency", quality_key="source_recall"):
+    """Configs not beaten on both speed (lower cost) and quality (higher recall)."""
+    front = []
+    for s in summaries:
+        dominated = any(
+            o[cost_key] <= s[cost_key] and o[quality_key] >= s[quality_key]
+            and (o[cost_key] < s[cost_key] or o[quality_key] > s[quality_key])
+            for o in summaries
+        )
+        if not dominated:
+            front.append(s)
+    return sorted(front, key=lambda s: s[cost_key])
+
+class ParameterSweep(MLflowRAGTracker):
+    def __init__(self, docs_path, models, questions=None, experiment_name="rag-parameter-sweep"):
+        super().__init__(experiment_name=experiment_name)
+        self.docs_path = docs_path
+        self.questions = questions or DEFAULT_QUESTIONS
+        # Breakers never open during a sweep: skipping a model for some configs would
+        # average their latency over fewer models and skew the comparison
+        self.comparison = ModelComparison(models, breakers=CircuitBreakerRegistry(failure_threshold=float("inf")))
+        # chunk hash -> (embedding, seconds it took to embed), shared across chunking configs so
+        # identical chunks are embedded once but every config is charged for all of its chunks
+        self._chunk_embeddings = {}
+
+    def build(self, chunk_size, chunk_overlap):
+        rag = RAGSystem(chunk_size=chunk_size, chunk_overlap=chunk_overlap, pool=self.comparison.rag.pool)
+        _, splits = rag.split_documents(self.docs_path)
+        keys = [hashlib.sha1(doc.page_content.encode()).hexdigest() for doc in splits]
+        missing = {key: doc.page_content for key, doc in zip(keys, splits) if key not in self._chunk_embeddings}
+        if missing:
+            start = time.time()
+            vectors = rag.embeddings.embed_documents(list(missing.values()))
+            per_chunk = (time.time() - start) / len(missing)
+            self._chunk_embeddings.update((key, (vector, per_chunk)) for key, vector in zip(missing, vectors))
+        # Independent of grid order: the cost of embedding every chunk this config produces
+        embed_time = sum(self._chunk_embeddings[key][1] for key in keys)
+
+        start = time.time()
+        rag.build_index(splits, vectors=[self._chunk_embeddings[key][0] for key in keys])
+        index_build_time = time.time() - start
+
+        index_dir = tempfile.mkdtemp(prefix="sweep_index_")
+        try:
+            rag.save_vectorstore(index_dir)
+            index_bytes = directory_bytes(index_dir)
+        finally:
+            shutil.rmtree(index_dir, ignore_errors=True)
+
+        return rag, {
+            "num_chunks": len(splits),
+            "reused_embeddings": len(splits) - len(missing),
+            "embed_time": embed_time,
+            "index_build_time": index_build_time,
+            "index_bytes": index_bytes
+        }
+
+    def evaluate(self, rag, k, search_repeats=5):
+        search_times = []
+        hits = 0
+        per_model = {model: {"latency": [], "prompt_tokens": [], "failures": 0} for model in self.comparison.models}
+
+        for question, expected_source in self.questions.items():
+            embedding, _ = rag.embed_question(question)
+            for _ in range(search_repeats):
+                start = time.time()
+                docs = rag.vectorstore.similarity_search_by_vector(embedding, k=k)
+                search_times.append(time.time() - start)
+            if any(os.path.basename(doc.metadata.get("source", "")) == expected_source for doc in docs):
+                hits += 1
+
+            results = self.comparison.compare(question, k=k, parallel=False)
+            for model, result in results.items():
+                if result["status"] != "ok":
+                    per_model[model]["failures"] += 1
+                    continue
+                per_model[model]["latency"].append(result["time_ms"] / 1000)
+                if result["usage"]["prompt_tokens"] is not None:
+                    per_model[model]["prompt_tokens"].append(result["usage"]["prompt_tokens"])
+
+        return {
+            "search_p95_ms": percentile(search_times, 95) * 1000,
+            "source_recall": hits / len(self.questions),
+            "per_model": per_model
+        }
+
+    def run(self, chunk_sizes, chunk_overlaps, ks):
+        summaries = []
+        for chunk_size in chunk_sizes:
+            for chunk_overlap in chunk_overlaps:
+                if chunk_overlap >= chunk_size:
+                    continue
+                rag, build = self.build(chunk_size, chunk_overlap)
+                self.comparison.rag = rag
+                for k in ks:
+                    run_name = f"sweep_cs{chunk_size}_co{chunk_overlap}_k{k}"
+                    with mlflow.start_run(run_name=run_name):
+                        mlflow.log_param("chunk_size", chunk_size)
+                        mlflow.log_param("chunk_overlap", chunk_overlap)
+                        mlflow.log_param("k", k)
+                        mlflow.log_param("num_questions", len(self.questions))
+                        mlflow.log_param("models", ",".join(self.comparison.models))
+                        mlflow.set_tags({"batch": "parameter_sweep"})
+
+                        mlflow.log_metric("num_chunks", build["num_chunks"])
+                        mlflow.log_metric("reused_embeddings", build["reused_embeddings"])
+                        mlflow.log_metric("embed_time", build["embed_time"])
+                        mlflow.log_metric("index_build_time", build["index_build_time"])
+                        mlflow.log_metric("index_bytes", build["index_bytes"])
+
+                        evaluation = self.evaluate(rag, k)
+                        mlflow.log_metric("search_p95_ms", evaluation["search_p95_ms"])
+                        mlflow.log_metric("source_recall", evaluation["source_recall"])
+
+                        generation = []
+                        failures = 0
+                        for model, stats in evaluation["per_model"].items():
+                            model_safe = model.replace(":", "_").replace(".", "_")
+                            failures += stats["failures"]
+                            mlflow.log_metric(f"{model_safe}_failures", stats["failures"])
+                            if stats["latency"]:
+                                generation.append(statistics.mean(stats["latency"]))
+                                mlflow.log_metric(f"{model_safe}_generation_latency", statistics.mean(stats["latency"]))
+                                mlflow.log_metric(f"{model_safe}_generation_p95", percentile(stats["latency"], 95))
+                            if stats["prompt_tokens"]:
+                                mlflow.log_metric(f"{model_safe}_prompt_tokens", statistics.mean(stats["prompt_tokens"]))
+
+                        latency = evaluation["search_p95_ms"] / 1000 + (statistics.mean(generation) if generation else 0)
+                        mlflow.log_metric("latency", latency)
+                        mlflow.log_metric("failed_generations", failures)
+
+                        summaries.append({
+                            "run_id": mlflow.active_run().info.run_id,
+                            "chunk_size": chunk_size,
+                            "chunk_overlap": chunk_overlap,
+                            "k": k,
+                            "latency": round(latency, 4),
+                            "source_recall": evaluation["source_recall"],
+                            "search_p95_ms": round(evaluation["search_p95_ms"], 3),
+                            "embed_time": round(build["embed_time"], 3),
+                            "index_build_time": round(build["index_build_time"], 3),
+                            "failed_generations": failures,
+                            "index_bytes": build["index_bytes"]
+                        })
+        return summaries
+
+    def report(self, summaries):
+        front = pareto_front(summaries)
+        with mlflow.start_run(run_name="sweep_pareto_summary"):
+            mlflow.set_tags({"batch": "parameter_sweep", "summary": "pareto"})
+            with open("sweep_results.json", "w", encoding="utf-8") as f:
+                json.dump({"configs": summaries, "pareto_front": front}, f, indent=2)
+            mlflow.log_artifact("sweep_results.json")
+
+        print(f"\n{'='*80}")
+        print("PARETO FRONT (latency vs source recall)")
+        print(f"{'='*80}")
+        print(f"{'chunk':>6} {'overlap':>8} {'k':>3} {'latency(s)':>11} {'recall':>7} {'search p95(ms)':>15} {'index(KB)':>10}")
+        for s in front:
+            print(f"{s['chunk_size']:>6} {s['chunk_overlap']:>8} {s['k']:>3} {s['latency']:>11.2f} "
+                  f"{s['source_recall']:>7.2f} {s['search_p95_ms']:>15.2f} {s['index_bytes'] / 1024:>10.1f}")
+        return front
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep chunking and retrieval parameters")
+    parser.add_argument("--docs", default="sample_docs")
+    parser.add_argument("--models", nargs="+", default=["qwen2.5:7b", "phi3:mini"])
+    parser.add_argument("--chunk-sizes", nargs="+", type=int, default=[250, 500, 1000])
+    parser.add_argument("--chunk-overlaps", nargs="+", type=int, default=[0, 50, 100])
+    parser.add_argument("--ks", nargs="+", type=int, default=[1, 3, 5])
+    args = parser.parse_args()
+
+    sweep = ParameterSweep(args.docs, args.models)
+    summaries = sweep.run(args.chunk_sizes, args.chunk_overlaps, args.ks)
+    sweep.report(summaries)
+
+if __name__ == "__main__":
+    main()
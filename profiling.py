@@ -0,0 +1,187 @@
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from concurrent.futures import Future
+from datetime import datetime
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse_stack(frame, thread_name):
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.append(thread_name)
+    return ";".join(reversed(labels))
+
+
+class SamplingProfiler:
+    """Samples every thread's stack at a fixed interval into collapsed-stack counts
+    (the input format of flamegraph.pl / speedscope)."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.counts = Counter()
+        self.samples = 0
+        self.started_at = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.counts
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                self.counts[collapse_stack(frame, names.get(thread_id, str(thread_id)))] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        return "\n".join(f"{stack} {count}" for stack, count in self.counts.most_common()) + "\n"
+
+
+class ProfilerManager:
+    def __init__(self, output_dir="profiles", interval=0.005):
+        self.output_dir = output_dir
+        self.interval = interval
+        # (header, value, remaining requests); None means per-request profiling is off
+        self.match = None
+        self.window = None
+        self._window_result = None
+        self._last_snapshot = None
+        self._lock = threading.Lock()
+
+    def write(self, name, content, extension="collapsed"):
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f"{name}-{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.{extension}")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        return path
+
+    def start_window(self, seconds):
+        """Returns a Future resolved with the output file when the window ends."""
+        with self._lock:
+            if self.window is not None:
+                raise RuntimeError("A profiling window is already running")
+            self.window = SamplingProfiler(self.interval)
+            self._window_result = result = Future()
+            self.window.start()
+        timer = threading.Timer(seconds, self.stop_window)
+        timer.daemon = True
+        timer.start()
+        return result
+
+    def stop_window(self):
+        with self._lock:
+            profiler, self.window = self.window, None
+            result, self._window_result = self._window_result, None
+        if profiler is None:
+            return None
+        profiler.stop()
+        path = self.write("profile-window", profiler.collapsed())
+        result.set_result(path)
+        return path
+
+    def set_match(self, header, value, max_requests=10):
+        with self._lock:
+            self.match = (header.lower().encode(), value.encode(), max_requests)
+
+    def clear_match(self):
+        with self._lock:
+            self.match = None
+
+    def claim_request(self, headers):
+        with self._lock:
+            if self.match is None:
+                return False
+            header, value, remaining = self.match
+            if (header, value) not in headers:
+                return False
+            self.match = (header, value, remaining - 1) if remaining > 1 else None
+            return True
+
+    def start_tracemalloc(self, frames=25):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self._last_snapshot = tracemalloc.take_snapshot()
+
+    def stop_tracemalloc(self):
+        tracemalloc.stop()
+        self._last_snapshot = None
+
+    def tracemalloc_snapshot(self, limit=25):
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc is not running")
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        if self._last_snapshot is not None:
+            stats = snapshot.compare_to(self._last_snapshot, "traceback")
+        else:
+            stats = snapshot.statistics("traceback")
+        self._last_snapshot = snapshot
+        current, peak = tracemalloc.get_traced_memory()
+        top = [str(stat) + "\n" + "\n".join(stat.traceback.format()) for stat in stats[:limit]]
+        path = self.write("tracemalloc", "\n\n".join(top) + "\n", extension="txt")
+        return {
+            "file": path,
+            "traced_bytes": current,
+            "peak_bytes": peak,
+            "top": [str(stat) for stat in stats[:limit]]
+        }
+
+    def files(self):
+        if not os.path.isdir(self.output_dir):
+            return []
+        return sorted(os.listdir(self.output_dir))
+
+    def status(self):
+        return {
+            "window_running": self.window is not None,
+            "match": None if self.match is None else {
+                "header": self.match[0].decode(), "value": self.match[1].decode(), "remaining": self.match[2]
+            },
+            "tracemalloc": tracemalloc.is_tracing(),
+            "output_dir": self.output_dir
+        }
+
+
+class ProfileMiddleware:
+    """Profiles requests whose headers match the configured rule. When no rule is
+    set the request passes straight through after a single attribute check."""
+
+    def __init__(self, app, manager):
+        self.app = app
+        self.manager = manager
+
+    async def __call__(self, scope, receive, send):
+        if self.manager.match is None or scope["type"] != "http" or not self.manager.claim_request(scope["headers"]):
+            return await self.app(scope, receive, send)
+        profiler = SamplingProfiler(self.manager.interval)
+        profiler.start()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            profiler.stop()
+            route = scope["path"].strip("/").replace("/", "_") or "root"
+            self.manager.write(f"profile-request-{route}", profiler.collapsed())
@@ -0,0 +1,163 @@
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS queries (
+    ts REAL NOT NULL,
+    model TEXT NOT NULL,
+    status TEXT NOT NULL,
+    k INTEGER,
+    latency_ms REAL,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    word_count INTEGER,
+    embedding_hit INTEGER,
+    retrieval_hit INTEGER,
+    source TEXT,
+    collection TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_queries_model_ts ON queries (model, ts);
+CREATE INDEX IF NOT EXISTS idx_queries_ts ON queries (ts);
+"""
+
+COLUMNS = (
+    "ts", "model", "status", "k", "latency_ms", "prompt_tokens", "completion_tokens",
+    "word_count", "embedding_hit", "retrieval_hit", "source", "collection"
+)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return round(sorted_values[int(round(p / 100.0 * (len(sorted_values) - 1)))], 2)
+
+
+def result_row(result, k, source, collection=None, ts=None):
+    usage = result.get("usage") or {}
+    cache = result.get("cache") or {}
+    latency_ms = result.get("time_ms")
+    if latency_ms is None:
+        latency_ms = result.get("failed_after", result["time"]) * 1000
+    return (
+        ts or time.time(),
+        result["model"],
+        result.get("status", "ok"),
+        k,
+        latency_ms,
+        usage.get("prompt_tokens"),
+        usage.get("completion_tokens"),
+        result["metrics"]["word_count"],
+        None if "embedding_hit" not in cache else int(cache["embedding_hit"]),
+        None if "retrieval_hit" not in cache else int(cache["retrieval_hit"]),
+        source,
+        collection
+    )
+
+
+class QueryHistoryStore:
+    """Append-only SQLite log of per-model query results.
+
+    Rows are queued by request handlers and written in batches by a background
+    thread, so recording never blocks a request on disk I/O.
+    """
+
+    def __init__(self, path="query_history.db", batch_size=200, flush_interval=1.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            # Databases created before collections existed lack the column
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(queries)")}
+            if "collection" not in columns:
+                conn.execute("ALTER TABLE queries ADD COLUMN collection TEXT")
+            conn.commit()
+        self._writer = threading.Thread(target=self._write_loop, name="query-history-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def record(self, results, k, source="api", collection=None):
+        now = time.time()
+        for result in results.values():
+            self._queue.put(result_row(result, k, source, collection=collection, ts=now))
+
+    def _write_loop(self):
+        conn = self._connect()
+        conn.execute("PRAGMA synchronous=NORMAL")
+        batch = []
+        deadline = time.time() + self.flush_interval
+        while not (self._stop.is_set() and self._queue.empty()):
+            try:
+                batch.append(self._queue.get(timeout=max(0.0, deadline - time.time())))
+            except queue.Empty:
+                pass
+            if len(batch) >= self.batch_size or time.time() >= deadline:
+                if batch:
+                    self._flush(conn, batch)
+                    batch = []
+                deadline = time.time() + self.flush_interval
+        if batch:
+            self._flush(conn, batch)
+        conn.close()
+
+    def _flush(self, conn, batch):
+        with conn:
+            conn.executemany(
+                f"INSERT INTO queries ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                batch
+            )
+
+    def close(self):
+        self._stop.set()
+        self._writer.join()
+
+    def stats(self, since, until, models=None, collection=None):
+        where = "ts >= ? AND ts < ?"
+        params = [since, until]
+        if models:
+            where += f" AND model IN ({', '.join('?' * len(models))})"
+            params.extend(models)
+        if collection:
+            where += " AND collection = ?"
+            params.append(collection)
+
+        with closing(self._connect()) as conn:
+            summary = conn.execute(
+                f"""SELECT model, COUNT(*), SUM(status != 'ok'), SUM(completion_tokens),
+                           SUM(CASE WHEN status = 'ok' THEN latency_ms END),
+                           AVG(retrieval_hit), AVG(embedding_hit)
+                    FROM queries WHERE {where} GROUP BY model""",
+                params
+            ).fetchall()
+            latencies = {}
+            for model, latency_ms in conn.execute(
+                f"SELECT model, latency_ms FROM queries WHERE {where} AND status = 'ok' ORDER BY model, latency_ms",
+                params
+            ):
+                latencies.setdefault(model, []).append(latency_ms)
+
+        window = max(until - since, 1e-9)
+        result = {}
+        for model, count, errors, completion_tokens, ok_latency_ms, retrieval_hit, embedding_hit in summary:
+            values = latencies.get(model, [])
+            result[model] = {
+                "count": count,
+                "errors": errors or 0,
+                "p50_ms": percentile(values, 50),
+                "p95_ms": percentile(values, 95),
+                "p99_ms": percentile(values, 99),
+                "queries_per_second": round(len(values) / window, 6),
+                "tokens_per_second": round(completion_tokens / (ok_latency_ms / 1000), 2)
+                if completion_tokens and ok_latency_ms else None,
+                "retrieval_cache_hit_ratio": retrieval_hit,
+                "embedding_cache_hit_ratio": embedding_hit
+            }
+        return result
@@ -1,47 +1,256 @@
 import os
-import ollama
+import hashlib
+import time
+import faiss
+import numpy as np
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
-from langchain_ollama import OllamaEmbeddings
 from langchain_community.document_loaders import DirectoryLoader, TextLoader
+from ollama_pool import OllamaPool, PooledOllamaEmbeddings
+from cache import LRUCache
+from compressed_index import CompressedVectorIndex, full_vectors_current, write_full_vectors
+from collection_manager import CURRENT_FILE, resolve_index_path
+from metadata_index import MetadataBitmapIndex, filter_key, normalize_source
+
+def _embedding_size(vector):
+    return vector.nbytes
+
+def _documents_size(docs):
+    return sum(len(doc.page_content) + 256 for doc in docs)
+
+def normalize_question(question):
+    return " ".join(question.split())
 
 class RAGSystem:
-    def __init__(self, embedding_model="nomic-embed-text", chunk_size=500, chunk_overlap=50):
-        self.embeddings = OllamaEmbeddings(model=embedding_model)
+    def __init__(self, embedding_model="nomic-embed-text", chunk_size=500, chunk_overlap=50, pool=None,
+                 compression=None):
+        self.pool = pool if pool is not None else OllamaPool.from_env()
+        self.embedding_model = embedding_model
+        self.embeddings = PooledOllamaEmbeddings(self.pool, model=embedding_model)
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
         self.vectorstore = None
-        
-    def load_documents(self, directory_path):
+        # Optional two-stage search over compressed vectors ("float16", "int8" or "pca:<dims>"),
+        # applied when a saved vectorstore is loaded
+        self.compression = compression if compression is not None else os.getenv("VECTOR_COMPRESSION") or None
+        self.compressed_index = None
+        # Per-source id bitmaps backing metadata-filtered search
+        self.metadata_index = None
+        # Changes whenever the vectorstore is rebuilt, updated or reloaded; cached
+        # embeddings and retrievals are only valid for the version they were made on
+        self.index_version = None
+        self.embedding_cache = LRUCache(
+            max_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", "4096")),
+            sizeof=_embedding_size
+        )
+        self.retrieval_cache = LRUCache(
+            max_entries=int(os.getenv("RETRIEVAL_CACHE_SIZE", "1024")),
+            sizeof=_documents_size
+        )
+
+    def split_documents(self, directory_path):
         loader = DirectoryLoader(directory_path, glob="**/*.txt", loader_cls=TextLoader)
         documents = loader.load()
-        
+        # The file's modification time, so a full rebuild keeps each file's own date
+        for doc in documents:
+            source = doc.metadata.get("source", "")
+            doc.metadata["ingested_at"] = os.path.getmtime(source) if os.path.exists(source) else time.time()
+
         text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=self.chunk_size,
             chunk_overlap=self.chunk_overlap
         )
-        splits = text_splitter.split_documents(documents)
-        
-        self.vectorstore = FAISS.from_documents(splits, self.embeddings)
+        return documents, text_splitter.split_documents(documents)
+
+    def load_documents(self, directory_path):
+        documents, splits = self.split_documents(directory_path)
+
+        self.build_index(splits)
         print(f"Loaded {len(documents)} documents, created {len(splits)} chunks")
-        
+
+    def build_index(self, splits, vectors=None):
+        # vectors lets callers reuse embeddings they already have for identical chunks
+        if vectors is None:
+            self.vectorstore = FAISS.from_documents(splits, self.embeddings)
+        else:
+            self.vectorstore = FAISS.from_embeddings(
+                list(zip([doc.page_content for doc in splits], vectors)),
+                self.embeddings,
+                metadatas=[doc.metadata for doc in splits]
+            )
+        self.metadata_index = MetadataBitmapIndex()
+        self.metadata_index.add(0, splits)
+        self._set_index_version(self._fingerprint_splits(splits))
+
+    def add_documents(self, directory_path):
+        if not self.vectorstore:
+            return self.load_documents(directory_path)
+        if self.compressed_index is not None:
+            raise ValueError("Cannot add documents to a compressed index; rebuild and reload the vectorstore.")
+        documents, splits = self.split_documents(directory_path)
+
+        # Documents already in the index are replaced rather than duplicated
+        stale = []
+        for source in {normalize_source(doc.metadata.get("source", "")) for doc in documents}:
+            stale.extend(self.vectorstore.index_to_docstore_id[int(i)] for i in self.metadata_index.ids_for_source(source))
+        if stale:
+            # Removing vectors renumbers the remaining ids, so the bitmaps are rebuilt
+            self.vectorstore.delete(stale)
+            self.metadata_index = MetadataBitmapIndex.build(self.vectorstore)
+
+        start_id = self.vectorstore.index.ntotal
+        self.vectorstore.add_documents(splits)
+        self.metadata_index.add(start_id, splits)
+        self._set_index_version(self._fingerprint_splits(splits, previous=self.index_version))
+        print(f"Added {len(documents)} documents, {len(splits)} chunks (replaced {len(stale)} chunks)")
+
     def save_vectorstore(self, path="vectorstore"):
+        if self.compressed_index is not None:
+            raise ValueError("Vectorstore is loaded compressed; save it before enabling compression.")
         if self.vectorstore:
             self.vectorstore.save_local(path)
+            self.metadata_index.save(path, self._fingerprint_path(path))
+            # Files saved directly into a collection directory supersede a reloaded version
+            if os.path.exists(os.path.join(path, CURRENT_FILE)):
+                os.remove(os.path.join(path, CURRENT_FILE))
             print(f"Vector store saved to {path}")
-            
+
     def load_vectorstore(self, path="vectorstore"):
+        path = resolve_index_path(path)
         self.vectorstore = FAISS.load_local(path, self.embeddings, allow_dangerous_deserialization=True)
+        self.compressed_index = None
+        index_version = self._fingerprint_path(path)
+        self.metadata_index = (
+            MetadataBitmapIndex.load(path, self.vectorstore.index.ntotal, index_version)
+            or MetadataBitmapIndex.build(self.vectorstore)
+        )
+        self._set_index_version(index_version)
         print(f"Vector store loaded from {path}")
-        
-    def query(self, question, model_name="qwen2.5:7b", k=3):
+        if self.compression:
+            self.enable_compression(path)
+
+    def enable_compression(self, path="vectorstore"):
+        index = self.vectorstore.index
+        if not full_vectors_current(path, self.index_version):
+            write_full_vectors(index, path, index_version=self.index_version)
+        self.compressed_index = CompressedVectorIndex(
+            os.path.join(path, "vectors.f32.npy"),
+            scheme=self.compression,
+            rerank_factor=int(os.getenv("VECTOR_RERANK_FACTOR", "4"))
+        )
+        # Drop FAISS's in-RAM float32 copy; the full vectors are read from the memory-mapped file
+        self.vectorstore.index = faiss.IndexFlatL2(index.d)
+        self.retrieval_cache.clear()
+        print(f"Compressed search enabled ({self.compression}): "
+              f"{self.compressed_index.memory_bytes() / 1e6:.1f} MB in RAM vs "
+              f"{self.compressed_index.full_bytes() / 1e6:.1f} MB float32")
+
+    def _fingerprint_splits(self, splits, previous=None):
+        digest = hashlib.blake2b(digest_size=16)
+        if previous:
+            digest.update(previous.encode())
+        digest.update(self.embedding_model.encode())
+        for doc in splits:
+            digest.update(str(doc.metadata.get("source", "")).encode())
+            digest.update(doc.page_content.encode())
+        return digest.hexdigest()
+
+    def _fingerprint_path(self, path):
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(self.embedding_model.encode())
+        for name in ("index.faiss", "index.pkl"):
+            with open(os.path.join(path, name), "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+        return digest.hexdigest()
+
+    def _set_index_version(self, version):
+        if version != self.index_version:
+            self.embedding_cache.clear()
+            self.retrieval_cache.clear()
+        self.index_version = version
+
+    def index_bytes(self):
+        # Estimate of what the loaded index keeps resident: vectors and chunk text
+        if not self.vectorstore:
+            return 0
+        if self.compressed_index is not None:
+            total = self.compressed_index.memory_bytes()
+        else:
+            total = self.vectorstore.index.ntotal * self.vectorstore.index.d * 4
+        for doc in self.vectorstore.docstore._dict.values():
+            total += len(doc.page_content) + 256
+        return total + self.metadata_index.memory_bytes()
+
+    def memory_bytes(self, index_bytes=None):
+        if index_bytes is None:
+            index_bytes = self.index_bytes()
+        return index_bytes + self.embedding_cache.bytes + self.retrieval_cache.bytes
+
+    def close(self):
+        self.vectorstore = None
+        self.compressed_index = None
+        self.metadata_index = None
+        self.embedding_cache.clear()
+        self.retrieval_cache.clear()
+
+    def cache_stats(self):
+        return {
+            "index_version": self.index_version,
+            "embedding": self.embedding_cache.stats(),
+            "retrieval": self.retrieval_cache.stats()
+        }
+
+    def embed_question(self, question):
+        key = (self.index_version, self.embedding_model, normalize_question(question))
+        embedding = self.embedding_cache.get(key)
+        if embedding is not None:
+            return embedding, True
+        embedding = np.asarray(self.embeddings.embed_query(key[2]), dtype=np.float32)
+        self.embedding_cache.put(key, embedding)
+        return embedding, False
+
+    def retrieve(self, question, k=3, filters=None):
+        """filters: optional dict with source_prefix, sources (file paths),
+        ingested_after and ingested_before (unix seconds)."""
         if not self.vectorstore:
             raise ValueError("No vector store loaded. Load documents first.")
-        
-        docs = self.vectorstore.similarity_search(question, k=k)
+
+        embedding, embedding_hit = self.embed_question(question)
+        mode = f"compressed:{self.compression}" if self.compressed_index is not None else "similarity"
+        key = (
+            self.index_version, hashlib.blake2b(embedding.tobytes(), digest_size=16).hexdigest(), k, mode,
+            filter_key(filters)
+        )
+        docs = self.retrieval_cache.get(key)
+        retrieval_hit = docs is not None
+        if not retrieval_hit:
+            docs = self._search(embedding, k, filters)
+            self.retrieval_cache.put(key, docs)
+        return docs, {"embedding_hit": embedding_hit, "retrieval_hit": retrieval_hit}
+
+    def _search(self, embedding, k, filters):
+        bitmap = self.metadata_index.bitmap(filters)
+        if self.compressed_index is not None:
+            ids, _ = self.compressed_index.search(embedding, k, bitmap=bitmap)
+            return [self._document(i) for i in ids]
+        if bitmap is None:
+            return self.vectorstore.similarity_search_by_vector(embedding, k=k)
+        # Filter inside the FAISS scan so k results come back from the matching sources only
+        # The selector takes the bitmap's length in bytes
+        selector = faiss.IDSelectorBitmap(self.metadata_index.nbytes, faiss.swig_ptr(bitmap))
+        _, ids = self.vectorstore.index.search(
+            embedding.reshape(1, -1), k, params=faiss.SearchParameters(sel=selector)
+        )
+        return [self._document(i) for i in ids[0] if i != -1]
+
+    def _document(self, index_id):
+        return self.vectorstore.docstore.search(self.vectorstore.index_to_docstore_id[int(index_id)])
+
+    def build_prompt(self, question, docs):
         context = "\n\n".join([doc.page_content for doc in docs])
-        
-        prompt = f"""Answer the question based on the following context:
+
+        return f"""Answer the question based on the following context:
 
 Context:
 {context}
@@ -49,15 +258,36 @@ Context:
 Question: {question}
 
 Answer:"""
-        
-        response = ollama.chat(
+
+    def stream_answer(self, question, docs, model_name="qwen2.5:7b", cancel=None):
+        # Yields Ollama chat chunks; the last one (done=True) carries token counts
+        return self.pool.chat_stream(
+            model=model_name,
+            messages=[{'role': 'user', 'content': self.build_prompt(question, docs)}],
+            cancel=cancel
+        )
+
+    def answer(self, question, docs, model_name="qwen2.5:7b"):
+        response = self.pool.chat(
             model=model_name,
-            messages=[{'role': 'user', 'content': prompt}]
+            messages=[{'role': 'user', 'content': self.build_prompt(question, docs)}]
         )
-        
-        answer = response['message']['content']
-        
+
+        return {
+            "answer": response['message']['content'],
+            "usage": {
+                "prompt_tokens": response.get('prompt_eval_count', None),
+                "completion_tokens": response.get('eval_count', None)
+            }
+        }
+
+    def query(self, question, model_name="qwen2.5:7b", k=3, filters=None):
+        docs, cache = self.retrieve(question, k=k, filters=filters)
+        result = self.answer(question, docs, model_name=model_name)
+
         return {
-            "answer": answer,
-            "sources": [doc.page_content[:200] for doc in docs]
-        }
\ No newline at end of file
+            "answer": result["answer"],
+            "sources": [doc.page_content[:200] for doc in docs],
+            "cache": cache,
+            "usage": result["usage"]
+        }
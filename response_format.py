@@ -0,0 +1,67 @@
+import msgpack
+import orjson
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import Response
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+
+
+def select_fields(results, fields):
+    if not fields:
+        return results
+    keep = set(fields) | {"model"}
+    return {
+        model: {key: value for key, value in result.items() if key in keep}
+        for model, result in results.items()
+    }
+
+
+def compact_results(results):
+    """Move per-model sources into one shared list and reference them by index.
+
+    Retrieval is identical for every model, so the full format mostly repeats
+    the same chunks once per model.
+    """
+    sources = []
+    source_index = {}
+    compact = {}
+    for model, result in results.items():
+        entry = {key: value for key, value in result.items() if key != "sources"}
+        if "sources" in result:
+            ids = []
+            for source in result["sources"]:
+                if source not in source_index:
+                    source_index[source] = len(sources)
+                    sources.append(source)
+                ids.append(source_index[source])
+            entry["source_ids"] = ids
+        compact[model] = entry
+    return sources, compact
+
+
+def wants_msgpack(accept):
+    return bool(accept) and any(t in accept for t in MSGPACK_TYPES)
+
+
+def render(payload, accept=None):
+    if wants_msgpack(accept):
+        return Response(content=msgpack.packb(payload, use_bin_type=True), media_type="application/msgpack")
+    return Response(content=orjson.dumps(payload), media_type="application/json")
+
+
+class SelectiveGZipMiddleware:
+    """GZipMiddleware that leaves some paths uncompressed.
+
+    Streaming endpoints are excluded because the compressor holds small writes
+    in its buffer, so events would reach the client in bursts instead of as sent.
+    """
+
+    def __init__(self, app, exclude_paths=(), **kwargs):
+        self.app = app
+        self.gzip = GZipMiddleware(app, **kwargs)
+        self.exclude_paths = set(exclude_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in self.exclude_paths:
+            return await self.app(scope, receive, send)
+        return await self.gzip(scope, receive, send)
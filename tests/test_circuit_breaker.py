@@ -0,0 +1,58 @@
+import threading
+
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from compare_models import ModelComparison
+
+
+def half_open_breaker():
+    breaker = CircuitBreaker("m", failure_threshold=1, recovery_timeout=0)
+    breaker.record_failure(RuntimeError("down"))
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    return breaker
+
+
+def test_opens_after_threshold_and_recovers_through_half_open():
+    breaker = CircuitBreaker("m", failure_threshold=2, recovery_timeout=0)
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+
+
+def test_release_frees_the_half_open_slot_without_closing():
+    breaker = half_open_breaker()
+    assert not breaker.allow()
+    breaker.release()
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+
+
+class StreamingRag:
+    def __init__(self, cancel):
+        self.cancel = cancel
+
+    def stream_answer(self, question, docs, model_name, cancel=None):
+        yield {"message": {"content": "partial"}}
+        self.cancel.set()
+        yield {"message": {"content": " answer"}, "done": True}
+
+
+def test_cancelled_stream_is_not_recorded_as_success():
+    cancel = threading.Event()
+    comparison = ModelComparison(["m"], rag=StreamingRag(cancel))
+    breaker = comparison.breakers.get("m")
+    breaker.failure_threshold = 1
+    breaker.recovery_timeout = 0
+    breaker.record_failure(RuntimeError("down"))
+    events = []
+
+    comparison.stream_single_model("m", "q", [], {}, events.append, cancel)
+
+    assert events[-1]["result"]["status"] == "cancelled"
+    assert breaker.state == HALF_OPEN
+    assert breaker.half_open_calls == 0
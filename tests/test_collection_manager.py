@@ -0,0 +1,183 @@
+import os
+import threading
+import time
+
+import pytest
+
+from collection_manager import CollectionManager, CollectionNotFound, resolve_index_path
+
+
+class FakeRag:
+    """Stands in for RAGSystem: an "index" is a text file, and loads can be held open."""
+
+    loads = 0
+    gate = None
+
+    def __init__(self, size=10):
+        self.size = size
+        self.closed = False
+        self.content = None
+
+    def load_vectorstore(self, path):
+        FakeRag.loads += 1
+        if FakeRag.gate is not None:
+            FakeRag.gate.wait(5)
+        with open(os.path.join(resolve_index_path(path), "index.faiss"), encoding="utf-8") as f:
+            self.content = f.read()
+
+    def load_documents(self, docs_path):
+        if docs_path == "broken":
+            raise RuntimeError("no documents")
+        self.content = docs_path
+
+    def save_vectorstore(self, path):
+        write_index(path, self.content)
+
+    def index_bytes(self):
+        return self.size
+
+    def memory_bytes(self, index_bytes=None):
+        return self.size
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture(autouse=True)
+def reset_fake():
+    FakeRag.loads = 0
+    FakeRag.gate = None
+    yield
+    FakeRag.gate = None
+
+
+def write_index(path, content):
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, "index.faiss"), "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+@pytest.fixture
+def manager(tmp_path):
+    write_index(str(tmp_path / "vectorstore"), "default")
+    for name in ("a", "b", "c"):
+        write_index(str(tmp_path / "collections" / name), name)
+    return CollectionManager(
+        FakeRag, base_dir=str(tmp_path / "collections"), default_path=str(tmp_path / "vectorstore"),
+        memory_budget_bytes=25
+    )
+
+
+def test_lists_and_rejects_unknown_collections(manager):
+    assert manager.available() == ["default", "a", "b", "c"]
+    with pytest.raises(CollectionNotFound):
+        manager.acquire("missing")
+    with pytest.raises(CollectionNotFound):
+        manager.acquire("../vectorstore")
+    assert manager.status()["loading"] == []
+
+
+def test_concurrent_first_requests_share_one_load(manager):
+    FakeRag.gate = threading.Event()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(manager.acquire("a"))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.2)
+    FakeRag.gate.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert FakeRag.loads == 1
+    assert len(results) == 5 and len({id(rag) for rag in results}) == 1
+    assert manager.status()["loaded"]["a"]["in_use"] == 5
+
+
+def test_evicts_least_recently_used_idle_collection(manager):
+    for name in ("a", "b"):
+        with manager.lease(name):
+            pass
+    with manager.lease("a"):
+        pass
+    b = manager.loaded()["b"]
+    with manager.lease("c"):
+        pass
+
+    assert list(manager.loaded()) == ["a", "c"]
+    assert b.closed
+
+
+def test_in_use_and_pinned_collections_are_not_evicted(manager):
+    manager.pin("default")
+    with manager.lease("default"):
+        pass
+    with manager.lease("a") as a:
+        with manager.lease("b"):
+            # Over budget, but everything is pinned or leased
+            assert set(manager.loaded()) == {"default", "a", "b"}
+        assert set(manager.loaded()) == {"default", "a"}
+    assert not a.closed
+    assert manager.status()["memory_bytes"] == 20
+
+
+def test_swap_retires_leased_index_until_released(manager):
+    old = manager.acquire("a")
+    new = FakeRag()
+    manager.swap("a", new)
+
+    assert manager.acquire("a") is new
+    assert not old.closed
+    assert manager.status()["retired"] == [{"name": "a", "in_use": 1}]
+    manager.release("a", old)
+    assert old.closed
+    assert manager.status()["retired"] == []
+
+
+def test_reload_builds_a_new_version_and_points_current_at_it(manager, tmp_path):
+    default = tmp_path / "vectorstore"
+    old = manager.acquire("default")
+    first = manager.reload("default", docs_path="docs-v1")
+    second = manager.reload("default", docs_path="docs-v2")
+
+    assert (first.content, second.content) == ("docs-v1", "docs-v2")
+    assert manager.acquire("default") is second
+    versions = os.listdir(default / "versions")
+    assert len(versions) == 1
+    assert (default / "CURRENT").read_text() == f"versions/{versions[0]}"
+    # The directory's original files are left alone
+    assert (default / "index.faiss").read_text() == "default"
+    manager.release("default", old)
+    assert old.closed and first.closed
+
+
+def test_failed_rebuild_keeps_serving_and_leaves_nothing_behind(manager, tmp_path):
+    serving = manager.reload("a", docs_path="docs-v1")
+    before = os.listdir(tmp_path / "collections" / "a" / "versions")
+
+    with pytest.raises(RuntimeError):
+        manager.reload("a", docs_path="broken")
+
+    assert os.listdir(tmp_path / "collections" / "a" / "versions") == before
+    assert manager.acquire("a") is serving
+
+
+def test_swap_waits_for_a_first_load_in_progress(manager):
+    FakeRag.gate = threading.Event()
+    loaded = []
+    loader = threading.Thread(target=lambda: loaded.append(manager.acquire("a")))
+    loader.start()
+    time.sleep(0.1)
+    new = FakeRag()
+    swapper = threading.Thread(target=manager.swap, args=("a", new))
+    swapper.start()
+    time.sleep(0.2)
+    assert swapper.is_alive()
+
+    FakeRag.gate.set()
+    loader.join(5)
+    swapper.join(5)
+
+    # The stale first load finishes its lease, then is closed; the swapped index is what serves
+    assert manager.acquire("a") is new
+    manager.release("a", loaded[0])
+    assert loaded[0].closed and not new.closed
@@ -0,0 +1,44 @@
+import threading
+
+from compare_models import ModelComparison
+
+
+class Doc:
+    def __init__(self, text):
+        self.page_content = text
+
+
+class CountingRag:
+    def __init__(self, fail=False):
+        self.retrievals = 0
+        self.fail = fail
+        self._lock = threading.Lock()
+
+    def retrieve(self, question, k=3, filters=None):
+        with self._lock:
+            self.retrievals += 1
+        if self.fail:
+            raise RuntimeError("embedding backend down")
+        return [Doc("chunk")], {"embedding_hit": False, "retrieval_hit": False}
+
+    def answer(self, question, docs, model_name):
+        return {"answer": f"{model_name} says hi", "usage": {"prompt_tokens": 1, "completion_tokens": 3}}
+
+
+def test_compare_retrieves_once_for_all_models():
+    models = ["a", "b", "c", "d"]
+    rag = CountingRag()
+    results = ModelComparison(models, rag=rag).compare("q", k=3, parallel=True)
+
+    assert rag.retrievals == 1
+    assert list(results) == models
+    assert all(r["status"] == "ok" and r["sources"] == ["chunk"] for r in results.values())
+
+
+def test_retrieval_failure_does_not_trip_model_breakers():
+    comparison = ModelComparison(["a", "b"], rag=CountingRag(fail=True))
+    for _ in range(5):
+        results = comparison.compare("q", parallel=False)
+
+    assert all(r["status"] == "error" for r in results.values())
+    assert comparison.breakers.status() == {}
@@ -0,0 +1,69 @@
+import tracemalloc
+
+import faiss
+import numpy as np
+import pytest
+
+from compressed_index import CompressedVectorIndex, exact_search, recall_at_k, write_full_vectors
+
+
+@pytest.fixture(scope="module")
+def vectors_path(tmp_path_factory):
+    rng = np.random.default_rng(0)
+    # Low intrinsic dimension plus noise, closer to real embeddings than uniform noise
+    basis = rng.normal(size=(24, 96)).astype(np.float32)
+    vectors = rng.normal(size=(20000, 24)).astype(np.float32) @ basis
+    vectors += rng.normal(scale=0.05, size=vectors.shape).astype(np.float32)
+    flat = faiss.IndexFlatL2(96)
+    flat.add(vectors)
+    return write_full_vectors(flat, str(tmp_path_factory.mktemp("store")))
+
+
+def queries(index, count=50):
+    rng = np.random.default_rng(1)
+    rows = np.asarray(index.full[rng.choice(index.ntotal, count, replace=False)], dtype=np.float32)
+    return rows + rng.normal(scale=0.1, size=rows.shape).astype(np.float32)
+
+
+@pytest.mark.parametrize("scheme", ["float16", "int8", "pca:32"])
+def test_recall_against_exact_search(vectors_path, scheme):
+    index = CompressedVectorIndex(vectors_path, scheme=scheme)
+
+    assert recall_at_k(index, queries(index), 3) >= 0.95
+    assert index.memory_bytes() < index.full_bytes() / 1.9
+
+
+@pytest.mark.parametrize("scheme", ["float16", "int8", "pca:32"])
+def test_bitmap_limits_results_to_allowed_ids(vectors_path, scheme):
+    index = CompressedVectorIndex(vectors_path, scheme=scheme)
+    allowed = np.zeros(index.ntotal, dtype=bool)
+    allowed[::7] = True
+    bitmap = np.packbits(allowed, bitorder="little")
+    subset = np.flatnonzero(allowed)
+
+    for query in queries(index, 10):
+        ids, distances = index.search(query, 3, bitmap=bitmap)
+        assert allowed[ids].all()
+        expected = subset[exact_search(np.asarray(index.full[subset]), query, 3)]
+        assert ids[0] == expected[0]
+        assert list(distances) == sorted(distances)
+
+    allowed[:] = False
+    allowed[[5, 12]] = True
+    ids, _ = index.search(queries(index, 1)[0], 3, bitmap=np.packbits(allowed, bitorder="little"))
+    assert sorted(ids.tolist()) == [5, 12]
+
+
+def test_search_does_not_materialize_float32_store(vectors_path):
+    index = CompressedVectorIndex(vectors_path, scheme="int8")
+    query = queries(index, 1)[0]
+    index.search(query, 3)
+
+    tracemalloc.start()
+    try:
+        index.search(query, 3)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert peak < index.full_bytes() / 50
@@ -0,0 +1,107 @@
+import hashlib
+import os
+
+import numpy as np
+import pytest
+
+from metadata_index import MetadataBitmapIndex
+from rag_system import RAGSystem
+
+
+class FakePool:
+    """Deterministic pseudo-random embeddings, so no Ollama server is needed."""
+
+    def embed(self, model, texts):
+        return [
+            np.random.default_rng(int(hashlib.md5(text.encode()).hexdigest()[:8], 16)).random(16).tolist()
+            for text in texts
+        ]
+
+
+def make_rag(compression=""):
+    return RAGSystem(pool=FakePool(), chunk_size=200, chunk_overlap=0, compression=compression)
+
+
+@pytest.fixture(scope="module")
+def docs(tmp_path_factory):
+    root = tmp_path_factory.mktemp("docs")
+    for folder in ("guides", "notes"):
+        os.makedirs(root / folder)
+        for i in range(3):
+            path = root / folder / f"{folder}{i}.txt"
+            path.write_text(" ".join(f"{folder} word{j} file{i}" for j in range(200)))
+            # ingested_at comes from the file's modification time
+            os.utime(path, (1000 * i + 1, 1000 * i + 1))
+    return str(root)
+
+
+@pytest.fixture(scope="module")
+def rag(docs):
+    rag = make_rag()
+    rag.load_documents(docs)
+    return rag
+
+
+def sources(found, docs):
+    return sorted({os.path.relpath(doc.metadata["source"], docs).replace(os.sep, "/") for doc in found})
+
+
+def brute_force(rag, question, filters, k):
+    query, _ = rag.embed_question(question)
+    vectors = rag.vectorstore.index.reconstruct_n(0, rag.vectorstore.index.ntotal)
+    allowed = np.unpackbits(rag.metadata_index.bitmap(filters), count=len(vectors), bitorder="little").astype(bool)
+    distances = ((vectors - query) ** 2).sum(axis=1)
+    distances[~allowed] = np.inf
+    return [rag._document(i).page_content for i in np.argsort(distances)[:k]]
+
+
+def test_filters_by_prefix_sources_and_date(rag, docs):
+    found, _ = rag.retrieve("guides word3", k=50, filters={"source_prefix": os.path.join(docs, "guides")})
+    assert sources(found, docs) == ["guides/guides0.txt", "guides/guides1.txt", "guides/guides2.txt"]
+
+    found, _ = rag.retrieve("guides word3", k=50, filters={"sources": [os.path.join(docs, "notes", "notes1.txt")]})
+    assert sources(found, docs) == ["notes/notes1.txt"]
+
+    found, _ = rag.retrieve("guides word3", k=50, filters={"ingested_after": 1500})
+    assert sources(found, docs) == ["guides/guides2.txt", "notes/notes2.txt"]
+
+    found, _ = rag.retrieve("guides word3", k=50, filters={"ingested_after": 500, "ingested_before": 2001})
+    assert sources(found, docs) == ["guides/guides1.txt", "notes/notes1.txt"]
+
+    found, _ = rag.retrieve("guides word3", k=5, filters={"source_prefix": os.path.join(docs, "missing")})
+    assert found == []
+
+
+def test_filtered_search_matches_brute_force(rag, docs):
+    filters = {"source_prefix": os.path.join(docs, "notes")}
+    found, _ = rag.retrieve("guides word3", k=5, filters=filters)
+
+    assert [doc.page_content for doc in found] == brute_force(rag, "guides word3", filters, 5)
+
+
+def test_compressed_filtered_search_matches_brute_force(rag, docs, tmp_path):
+    rag.save_vectorstore(str(tmp_path))
+    compressed = make_rag(compression="int8")
+    compressed.load_vectorstore(str(tmp_path))
+    filters = {"sources": [os.path.join(docs, "notes", "notes1.txt"), os.path.join(docs, "guides", "guides2.txt")]}
+
+    found, _ = compressed.retrieve("guides word3", k=5, filters=filters)
+
+    assert [doc.page_content for doc in found] == brute_force(rag, "guides word3", filters, 5)
+
+
+def test_saved_bitmaps_load_only_for_the_same_index(rag, tmp_path):
+    rag.save_vectorstore(str(tmp_path))
+    reloaded = make_rag()
+    reloaded.load_vectorstore(str(tmp_path))
+
+    assert set(reloaded.metadata_index.bitmaps) == set(rag.metadata_index.bitmaps)
+    for source, bitmap in rag.metadata_index.bitmaps.items():
+        assert np.array_equal(reloaded.metadata_index.bitmaps[source], bitmap)
+    assert reloaded.metadata_index.ingested_at == rag.metadata_index.ingested_at
+
+    ntotal = rag.vectorstore.index.ntotal
+    assert MetadataBitmapIndex.load(str(tmp_path), ntotal, reloaded.index_version) is not None
+    # Same size, different index: the fingerprint rejects the stale bitmaps
+    assert MetadataBitmapIndex.load(str(tmp_path), ntotal, "another-index") is None
+    assert MetadataBitmapIndex.load(str(tmp_path), ntotal + 1, reloaded.index_version) is None
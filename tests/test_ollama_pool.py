@@ -0,0 +1,268 @@
+import json
+import select
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from ollama_pool import OllamaPool
+
+
+class FakeOllama:
+    """Minimal Ollama server: /api/tags, /api/ps, /api/chat (plain or streamed) and /api/embed."""
+
+    def __init__(self, models=("phi3:mini",), loaded=(), delay=0.0):
+        self.models = list(models)
+        self.loaded = list(loaded)
+        self.delay = delay
+        self.chats = 0
+        self.aborted = 0
+        self.active = 0
+        self.max_active = 0
+        # One handler instance per TCP connection, so this counts connections that served a chat
+        self.chat_connections = set()
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def host(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _client_waited(self, seconds):
+                # Sleep like a model evaluating the prompt, but notice when the client hangs up
+                deadline = time.time() + seconds
+                while time.time() < deadline:
+                    readable, _, _ = select.select([self.connection], [], [], min(0.05, deadline - time.time()))
+                    if readable and not self.connection.recv(1, socket.MSG_PEEK):
+                        with fake._lock:
+                            fake.aborted += 1
+                        self.close_connection = True
+                        return False
+                return True
+
+            def _stream(self, model):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                for content, done in (("hello ", False), (fake.host, False), ("", True)):
+                    chunk = {"model": model, "created_at": "2026-01-01T00:00:00Z",
+                             "message": {"role": "assistant", "content": content}, "done": done}
+                    if done:
+                        chunk["eval_count"] = 2
+                    self.wfile.write(json.dumps(chunk).encode() + b"\n")
+                    self.wfile.flush()
+
+            def do_GET(self):
+                if self.path == "/api/tags":
+                    self._send({"models": [{"name": m, "model": m} for m in fake.models]})
+                elif self.path == "/api/ps":
+                    self._send({"models": [{"name": m, "model": m} for m in fake.loaded]})
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if self.path == "/api/embed":
+                    self._send({"model": request["model"], "embeddings": [[0.1, 0.2] for _ in request["input"]]})
+                    return
+                with fake._lock:
+                    fake.chats += 1
+                    fake.chat_connections.add(id(self))
+                    fake.active += 1
+                    fake.max_active = max(fake.max_active, fake.active)
+                try:
+                    if not self._client_waited(fake.delay):
+                        return
+                    if request.get("stream"):
+                        self._stream(request["model"])
+                        return
+                    self._send({
+                        "model": request["model"],
+                        "created_at": "2026-01-01T00:00:00Z",
+                        "message": {"role": "assistant", "content": fake.host},
+                        "done": True,
+                        "eval_count": 1
+                    })
+                finally:
+                    with fake._lock:
+                        fake.active -= 1
+
+        return Handler
+
+
+@pytest.fixture
+def fakes():
+    servers = []
+
+    def make(**kwargs):
+        server = FakeOllama(**kwargs).start()
+        servers.append(server)
+        return server
+
+    yield make
+    for server in servers:
+        server.stop()
+
+
+def chat(pool, model="phi3:mini"):
+    return pool.chat(model, [{"role": "user", "content": "hi"}])["message"]["content"]
+
+
+def test_routes_to_least_outstanding_backend(fakes):
+    a, b = fakes(delay=0.3), fakes(delay=0.3)
+    pool = OllamaPool([a.host, b.host], timeout=5)
+    pool.check_health()
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda _: chat(pool), range(4)))
+
+    assert (a.chats, b.chats) == (2, 2)
+    assert a.max_active == b.max_active == 2
+    assert all(backend.outstanding == 0 for backend in pool.backends)
+
+
+def test_prefers_backend_with_model_loaded(fakes):
+    cold, warm = fakes(), fakes(loaded=("phi3:mini",))
+    pool = OllamaPool([cold.host, warm.host], timeout=5)
+    pool.check_health()
+
+    assert chat(pool) == warm.host
+    assert cold.chats == 0
+
+
+def test_skips_unhealthy_backend(fakes):
+    down, up = fakes(), fakes()
+    down.stop()
+    pool = OllamaPool([down.host, up.host], timeout=2)
+    pool.check_health()
+
+    assert [backend.healthy for backend in pool.backends] == [False, True]
+    for _ in range(3):
+        assert chat(pool) == up.host
+    assert pool.embed("nomic-embed-text", ["a", "b"]) == [[0.1, 0.2], [0.1, 0.2]]
+
+
+def test_falls_back_when_every_backend_is_unhealthy(fakes):
+    server = fakes()
+    pool = OllamaPool([server.host], timeout=5)
+    # Marked unhealthy by a failed check, but the call itself still gets a chance
+    pool.backends[0].healthy = False
+
+    assert chat(pool) == server.host
+
+
+def prime_latencies(pool, model, seconds, count=20):
+    for _ in range(count):
+        pool.latencies.record(model, seconds)
+
+
+def test_hedge_wins_over_slow_primary_and_releases_it(fakes):
+    slow, fast = fakes(delay=3.0), fakes()
+    pool = OllamaPool([slow.host, fast.host], timeout=10, hedge_percentile=95)
+    pool.check_health()
+    prime_latencies(pool, "phi3:mini", 0.1)
+
+    start = time.time()
+    assert chat(pool) == fast.host
+    assert time.time() - start < 1.5
+    # The cancelled primary gives its slot back as soon as the hedge wins
+    assert [backend.outstanding for backend in pool.backends] == [0, 0]
+    assert slow.chats == fast.chats == 1
+
+
+def test_hedged_calls_are_not_capped_by_a_shared_executor(fakes):
+    a, b = fakes(delay=0.5), fakes(delay=0.5)
+    pool = OllamaPool([a.host, b.host], timeout=10, hedge_percentile=95)
+    pool.check_health()
+    prime_latencies(pool, "phi3:mini", 5.0)
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=12) as executor:
+        list(executor.map(lambda _: chat(pool), range(12)))
+
+    assert time.time() - start < 1.5
+    assert a.chats + b.chats == 12
+
+
+def test_hedge_ready_calls_reuse_pooled_connections(fakes):
+    a, b = fakes(), fakes()
+    pool = OllamaPool([a.host, b.host], timeout=10, hedge_percentile=95)
+    pool.check_health()
+    # High threshold: every call takes the hedge-capable path but no hedge is sent
+    prime_latencies(pool, "phi3:mini", 5.0)
+
+    for _ in range(6):
+        chat(pool)
+
+    assert a.chats + b.chats == 6
+    assert len(a.chat_connections) + len(b.chat_connections) <= 2
+
+
+def test_chat_stream_yields_chunks_and_releases_backend(fakes):
+    server = fakes()
+    pool = OllamaPool([server.host], timeout=5)
+    pool.check_health()
+
+    chunks = list(pool.chat_stream("phi3:mini", [{"role": "user", "content": "hi"}]))
+
+    assert "".join(c["message"]["content"] for c in chunks) == "hello " + server.host
+    assert chunks[-1]["done"] and chunks[-1]["eval_count"] == 2
+    assert pool.backends[0].outstanding == 0
+
+
+def test_cancel_closes_stream_during_slow_prompt(fakes):
+    server = fakes(delay=5.0)
+    pool = OllamaPool([server.host], timeout=10)
+    pool.check_health()
+    cancel = threading.Event()
+    received = []
+
+    consumer = threading.Thread(target=lambda: received.extend(
+        pool.chat_stream("phi3:mini", [{"role": "user", "content": "hi"}], cancel=cancel)
+    ))
+    consumer.start()
+    time.sleep(0.3)
+    cancel.set()
+    start = time.time()
+    consumer.join(timeout=2)
+
+    assert not consumer.is_alive() and received == []
+    # The connection is closed before any chunk arrives, so the server stops working on it
+    deadline = time.time() + 2
+    while (server.aborted == 0 or pool.backends[0].outstanding) and time.time() < deadline:
+        time.sleep(0.02)
+    assert server.aborted == 1
+    assert pool.backends[0].outstanding == 0
+    assert time.time() - start < 1.0